@@ -1,18 +1,36 @@
 # app.py — 票速通 LINE Bot  (2025-07-25)
 
+import startup  # 最先 import，开机计时从这里开始有 mark
+
 import os
-import json
+import hmac
+import atexit
 import logging
-from flask import Flask, request, abort
+import threading
+from flask import Flask, Response, request, abort, jsonify
 from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import (
-    Configuration, ApiClient, MessagingApi,
-    ReplyMessageRequest, TextMessage,
+    Configuration, TextMessage,
     FlexMessage, FlexContainer
 )
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
 
+from event_queue import EventWorkerPool
+from line_client import LineClient
+from flex_cache import FlexCache
+from router import Router, MessageContext
+from consent_store import open_consent_store
+from state_backend import open_state_backend
+from dedup import EventDedup
+from metrics import Registry
+from catalog import CatalogWatcher, Concert
+from outbound import OutboundScheduler
+from fanout import MulticastFanout, fanout_job_id
+from orders import OrderStore, OrderError, ORDER_FORM_TEMPLATE, parse_order, looks_like_order_form
+
+startup.mark("imports")
+
 # ────────────────────────────
 # Logging
 # ────────────────────────────
@@ -29,9 +47,80 @@ app = Flask(__name__)
 # ────────────────────────────
 ACCESS_TOKEN = os.environ["LINE_CHANNEL_ACCESS_TOKEN"]
 CHANNEL_SECRET = os.environ["LINE_CHANNEL_SECRET"]
-configuration = Configuration(access_token=ACCESS_TOKEN)
+# LINE_API_HOST 只在压测 / 本地 stub 时设定
+configuration = Configuration(access_token=ACCESS_TOKEN,
+                              host=os.environ.get("LINE_API_HOST") or None)
 handler = WebhookHandler(CHANNEL_SECRET)
 
+# 整个 process 共用一个连线池（keep-alive），不再每则讯息重新握手
+line_client = LineClient(
+    configuration,
+    pool_size=int(os.environ.get("LINE_POOL_SIZE", "10")),
+    block=os.environ.get("LINE_POOL_BLOCK", "1") != "0",
+)
+startup.mark("line_client")
+
+# ────────────────────────────
+# Metrics  (多 worker 时设 METRICS_DIR 让 /metrics 合并全部 worker)
+# ────────────────────────────
+metrics = Registry(os.environ.get("METRICS_DIR") or None,
+                   flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", "1.0")))
+EVENTS_TOTAL = metrics.counter(
+    "ticketbot_events_total", "Webhook events by result", ("result",))
+SIGNATURE_FAILURES = metrics.counter(
+    "ticketbot_signature_failures_total", "Webhook requests with an invalid X-Line-Signature")
+HANDLER_SECONDS = metrics.histogram(
+    "ticketbot_handler_seconds", "handle_message latency per route", ("route",))
+REPLY_SECONDS = metrics.histogram(
+    "ticketbot_reply_seconds", "reply_message latency by HTTP status", ("status",))
+metrics.gauge("ticketbot_event_queue_depth", "Events waiting in the worker queues",
+              lambda: event_pool.depth() if event_pool is not None else 0)
+metrics.gauge("ticketbot_line_pool_requests", "Requests sent through the Messaging API pool",
+              lambda: line_client.stats()["requests"])
+metrics.gauge("ticketbot_line_pool_connections", "Connections opened by the Messaging API pool",
+              lambda: line_client.stats()["connections"])
+PUSH_SECONDS = metrics.histogram(
+    "ticketbot_push_seconds", "push / multicast latency by HTTP status", ("kind", "status"))
+OUTBOUND_EVENTS = metrics.counter(
+    "ticketbot_outbound_events_total", "Outbound scheduler events (sent, retried, fallback, ...)",
+    ("event",))
+
+
+def observe_send(kind: str, status: str, seconds: float):
+    if kind == "reply":
+        REPLY_SECONDS.observe(seconds, status)
+        if status == "200":
+            startup.first_reply()
+    else:
+        PUSH_SECONDS.observe(seconds, kind, status)
+
+
+# ────────────────────────────
+# Outbound 排程  (速率为每个 process；gunicorn 按 WEB_CONCURRENCY 平分 channel 上限)
+# ────────────────────────────
+_rate_share = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+OUTBOUND_RATES = {
+    "reply": float(os.environ.get("OUTBOUND_REPLY_RATE", 2000 / _rate_share)),
+    "push": float(os.environ.get("OUTBOUND_PUSH_RATE", 2000 / _rate_share)),
+    "multicast": float(os.environ.get("OUTBOUND_MULTICAST_RATE", 200 / _rate_share)),
+}
+OUTBOUND_MAX_ATTEMPTS = int(os.environ.get("OUTBOUND_MAX_ATTEMPTS", "5"))
+REPLY_TOKEN_TTL = float(os.environ.get("REPLY_TOKEN_TTL", "50"))
+OUTBOUND_PUSH_FALLBACK = os.environ.get("OUTBOUND_PUSH_FALLBACK", "1") != "0"
+outbound = OutboundScheduler(
+    lambda: line_client.api,
+    rates=OUTBOUND_RATES,
+    workers=int(os.environ.get("OUTBOUND_WORKERS", "8")),
+    max_attempts=OUTBOUND_MAX_ATTEMPTS,
+    reply_ttl=REPLY_TOKEN_TTL,
+    push_fallback=OUTBOUND_PUSH_FALLBACK,
+    observer=observe_send,
+    on_event=OUTBOUND_EVENTS.inc,
+)
+atexit.register(outbound.stop)
+metrics.gauge("ticketbot_outbound_queue_depth", "Messages waiting in the outbound scheduler",
+              outbound.depth)
+
 boss_user_id = os.environ.get("BOSS_USER_ID", "")
 manager_user_ids = {boss_user_id} if boss_user_id else set()
 
@@ -43,29 +132,43 @@ TOS_PDF_URL = "https://fticket-botv1.onrender.com/static/tos_privacy_v1.pdf"
 TOS_CONFIRM_TEXT = f"我同意，並了解自我權益關於票速通條款{TOS_VERSION}"
 
 # ────────────────────────────
-# 用户同意列表文件
+# 用户同意纪录  (CONSENT_BACKEND=log|sqlite)
 # ────────────────────────────
-ACCEPTED_USERS_FILE = "accepted_users.json"
-
-
-def load_accepted_users():
-    if os.path.exists(ACCEPTED_USERS_FILE):
-        with open(ACCEPTED_USERS_FILE, "r", encoding="utf-8") as f:
-            return set(json.load(f))
-    return set()
+ACCEPTED_USERS_FILE = "accepted_users.json"     # 旧版格式，只在第一次启动时汇入
+CONSENT_BACKEND = os.environ.get("CONSENT_BACKEND", "log")
+CONSENT_STORE_PATH = os.environ.get(
+    "CONSENT_STORE_PATH",
+    "accepted_users.sqlite3" if CONSENT_BACKEND == "sqlite" else "accepted_users.jsonl")
 
-
-def save_accepted_users():
-    with open(ACCEPTED_USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(list(accepted_terms_users), f, ensure_ascii=False, indent=2)
+consent_store = open_consent_store(CONSENT_BACKEND, CONSENT_STORE_PATH,
+                                   legacy_path=ACCEPTED_USERS_FILE, legacy_version="v1")
+atexit.register(consent_store.close)
+startup.mark("consent_store")
 
 
 # ────────────────────────────
 # 状态
 # ────────────────────────────
-accepted_terms_users: set[str] = load_accepted_users()
-submitted_users: set[str] = set()
-auto_reply = False
+# STATE_BACKEND=sqlite 时所有 worker 共用；memory 只在本 process
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "sqlite")
+state = open_state_backend(STATE_BACKEND, os.environ.get("STATE_DB_PATH", "bot_state.sqlite3"))
+startup.mark("state")
+
+# ────────────────────────────
+# 预订单  (送出范本后 ORDER_FORM_TTL 秒内回传的单会记到该场演唱会)
+# ────────────────────────────
+ORDER_FORM_TTL = float(os.environ.get("ORDER_FORM_TTL", "1800"))
+order_store = OrderStore(os.environ.get("ORDERS_DB_PATH", "orders.sqlite3"))
+atexit.register(order_store.close)
+ORDERS_TOTAL = metrics.counter(
+    "ticketbot_orders_total", "Order forms received by result", ("result",))
+# 匯出用；没设就不开放 /admin/orders.csv
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+startup.mark("orders")
+
+# 开卖通知群发：每批 500 人，最多 FANOUT_MAX_IN_FLIGHT 批同时送
+fanout = MulticastFanout(outbound, state,
+                         max_in_flight=int(os.environ.get("FANOUT_MAX_IN_FLIGHT", "4")))
 
 # ────────────────────────────
 # 关键字回应
@@ -87,15 +190,6 @@ KEYWORD_REPLIES = {
         "➣ 若有任何問題，請隨時聯絡我們的客服。\n\n"
         "💬 如有疑問，請點「[!!!]票速通使用教學」了解更多。"
     ),
-    "[!!!]演唱會代操": (
-        "目前可預約 2025 演唱會：\n"
-        "➣ JOLIN蔡依林 PLEASURE世界巡迴演唱會 TAIPEI 2025-2026\n"
-        "➣ BABYMONSTER 寶怪演唱會\n"
-        "➣ 鄧紫棋 演唱會（預計明年3-4月）\n"
-        "➣ TWICE台北大巨蛋2026演唱會－3/21 (六) \n"
-
-        "✓ 一切費用，都是等到有確實「完成您所委託的票券」才進行付款。全網最低價！請點下方「演唱會代購購票」開始。"
-    ),
 }
 
 # ═════════════════════════════════════════════
@@ -145,48 +239,97 @@ def create_bubble(title, date, location, price, system,
     }
 
 
-CONCERT_BUBBLES = [
-    create_bubble(
-                "JOLIN蔡依林 PLEASURE世界巡迴演唱會 TAIPEI 2025-2026",
-                "2025/12/30-2026/01/01 PM19:30", 
-                "臺北大巨蛋",
-                "NT$6,990 / NT$5,990 / NT$4,990 / NT$3,990 / NT$2,990 / NT$990",
-                "KKTIX",
-                "https://img3.uploadhouse.com/fileuploads/32225/322254936c4243b09130acb1a7fcb502bc0fe8fc.png",
-                "蔡依林",
-                badge_text="HOT🔥"
-            ),
-    create_bubble(
-                "BABYMONSTER ”LOVE MONSTERS” ASIA FAN CONCERT 台北站",
-                "2026/01/02-2026/01/03", 
-                "台北小巨蛋",
-                "NT$6500 / $5600 / $4800 / $4200 / $3200 / $2200 / $800",
-                "KKTIX",
-                "https://img4.uploadhouse.com/fileuploads/32225/32225494d10d343829f0d59bcc5a3f9be95b4c3c.png",
-                "BABYMONSTER",
-                badge_text="HOT🔥"
-            ),
-    create_bubble(
-                "2026 TWICE <THIS IS FOR> WORLD TOUR",
-                "2026/03/21 (六)", 
-                "台北大巨蛋",
-                "Comimg soon...",
-                "Comimg soon...",
-                "https://img6.uploadhouse.com/fileuploads/32225/32225496ec7d0a98c1d523af28d58db24591a05b.png",
-                "TWICE",
-                badge_text="即將來🔥"
-            ),
-    create_bubble(
-                "鄧紫棋演唱會",
-                "Comimg soon...", 
-                "Comimg soon...",
-                "Comimg soon...",
-                "Comimg soon...",
-                "https://img1.uploadhouse.com/fileuploads/31980/31980371b9850a14e08ec5f39c646f7b5068e008.png",
-                "鄧紫棋",
-                badge_text="即將來🔥"
-            )
-]
+# ────────────────────────────
+# 演唱會目錄  (concerts.json，改档案即生效，不必重新部署)
+# ────────────────────────────
+CONCERT_CATALOG = os.environ.get(
+    "CONCERT_CATALOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "concerts.json"))
+
+
+def _concert_bubble(c: Concert):
+    return create_bubble(c.title, c.date, c.location, c.price, c.system,
+                         c.image_url, c.keyword, badge_text=c.badge)
+
+
+catalog = CatalogWatcher(CONCERT_CATALOG, _concert_bubble,
+                         interval=float(os.environ.get("CONCERT_CATALOG_INTERVAL", "2")))
+startup.mark("catalog")
+
+# 互動教學（FlexMessage 四按鈕）
+TEACH_BUBBLE = {
+    "type": "bubble",
+    "body": {"type": "box", "layout": "vertical", "spacing": "sm", "contents": [
+        {"type": "text", "text": "📘 您想要進一步了解什麼？",
+            "weight": "bold", "size": "md"}
+    ]},
+    "footer": {"type": "box", "layout": "vertical", "spacing": "sm", "contents": [
+        {"type": "button", "action": {"type": "message",
+                                    "label": "常見Q&A", "text": "常見問題Q&A"}, "style": "primary"},
+        {"type": "button", "action": {"type": "message",
+                                    "label": "預約演唱會教學", "text": "怎麼預約演唱會？"}, "style": "primary"},
+        {"type": "button", "action": {"type": "message",
+                                    "label": "集點卡是什麼？", "text": "集點卡可以幹嘛？"}, "style": "primary"},
+        {"type": "button", "action": {"type": "message",
+                                    "label": "我都學會了", "text": "我都會了！"}, "style": "primary"},
+    ]}
+}
+
+# ────────────────────────────
+# Flex 快取  (来源资料不变就沿用已验证的讯息)
+# ────────────────────────────
+flex_cache = FlexCache()
+
+
+def _carousel_messages():
+    snap = catalog.current()
+    return flex_cache.get("carousel", snap, lambda: [
+        TextMessage(text=snap.intro_text),
+        FlexMessage(alt_text="演唱會列表", contents=FlexContainer.from_dict(
+            {"type": "carousel", "contents": list(snap.bubbles)})),
+    ])
+
+
+def _terms_messages():
+    return flex_cache.get("terms", (TOS_VERSION, TOS_PDF_URL, TOS_CONFIRM_TEXT), lambda: [
+        FlexMessage(alt_text="請先詳閱並同意《票速通服務條款》繼續服務。",
+                    contents=FlexContainer.from_dict(_terms_bubble())),
+    ])
+
+
+def _teach_messages():
+    return flex_cache.get("teach", TEACH_BUBBLE, lambda: [
+        FlexMessage(alt_text="互動教學", contents=FlexContainer.from_dict(TEACH_BUBBLE)),
+    ])
+
+
+def preload_payloads():
+    _carousel_messages()
+    _terms_messages()
+    _teach_messages()
+
+
+# ────────────────────────────
+# 冷启动 warm-up  (免费方案休眠醒来，第一则回覆不用再等建讯息、TLS 握手)
+# ────────────────────────────
+WARM_UP = os.environ.get("WARM_UP", "1") != "0"
+WARM_UP_CONNECT = os.environ.get("WARM_UP_CONNECT", "1") != "0"
+
+
+def _warm_connection():
+    # get_bot_info 很轻：把连线池的第一条连线（TLS）开好，顺便走过一次回应解析
+    try:
+        line_client.api.get_bot_info()
+        startup.mark("api_connected")
+    except Exception as e:
+        logging.warning(f"[Warm-up 连线失败] {e}")
+
+
+def warm_up(connect: bool = True):
+    """第一个真实事件前：建好并序列化静态讯息，背景打开 Messaging API 连线。"""
+    if connect:
+        threading.Thread(target=_warm_connection, name="warm-up", daemon=True).start()
+    preload_payloads()
+    startup.mark("payloads")
 
 # ────────────────────────────
 # Webhook 入口
@@ -195,21 +338,79 @@ CONCERT_BUBBLES = [
 
 @app.route("/callback", methods=["POST"])
 def callback():
+    metrics.start()
     signature = request.headers["X-Line-Signature"]
     body = request.get_data(as_text=True)
     try:
-        handler.handle(body, signature)
+        events = handler.parser.parse(body, signature)
     except InvalidSignatureError:
+        SIGNATURE_FAILURES.inc()
         abort(400)
+
+    for event in events:
+        event_id = getattr(event, "webhook_event_id", None)
+        delivery = getattr(event, "delivery_context", None)
+        # LINE 重送的事件已处理过就直接略过
+        if not event_dedup.claim(event_id, getattr(delivery, "is_redelivery", False)):
+            EVENTS_TOTAL.inc("duplicate")
+            continue
+        if event_pool is None:
+            EVENTS_TOTAL.inc("accepted")
+            try:
+                _dispatch_event(event)
+            except Exception:
+                event_dedup.release(event_id)
+                raise
+        # 背景模式：丢进佇列立即回 200
+        elif event_pool.submit(event_key(event), event):
+            EVENTS_TOTAL.inc("accepted")
+        else:
+            event_dedup.release(event_id)
+            EVENTS_TOTAL.inc("rejected")
+            logging.warning("[Event 佇列已滿] 回 503 讓 LINE 稍後重送")
+            abort(503)
     return "OK"
 
+
+def event_key(event) -> str:
+    source = getattr(event, "source", None)
+    return getattr(source, "user_id", None) or ""
+
+
+def _dispatch_event(event):
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        handle_message(event)
+
+# ────────────────────────────
+# 背景事件池  (EVENT_WORKERS=0 时维持同步处理)
+# ────────────────────────────
+
+
+EVENT_WORKERS = int(os.environ.get("EVENT_WORKERS", "0"))
+event_pool = EventWorkerPool(
+    _dispatch_event,
+    workers=EVENT_WORKERS,
+    maxsize=int(os.environ.get("EVENT_QUEUE_SIZE", "1000")),
+    put_timeout=float(os.environ.get("EVENT_ENQUEUE_TIMEOUT", "1.0")),
+) if EVENT_WORKERS > 0 else None
+
+if event_pool is not None:
+    atexit.register(event_pool.stop)
+
+# 重送去重  (DEDUP_SHARED=1 时再经共用状态确认，跨 worker 也不重复)
+event_dedup = EventDedup(
+    max_size=int(os.environ.get("DEDUP_MAX_SIZE", "50000")),
+    ttl=float(os.environ.get("DEDUP_TTL", "600")),
+    shared=state if os.environ.get("DEDUP_SHARED", "0") == "1" else None,
+)
+
 # ────────────────────────────
 # 條款 Bubble
 # ────────────────────────────
 
 
-def _send_terms(api: MessagingApi, reply_token: str):
-    bubble = {
+def _terms_bubble():
+    return {
         "type": "bubble",
         "body": {"type": "box", "layout": "vertical", "spacing": "sm", "contents": [
             {"type": "text", "text": "請先詳閱《票速通服務條款》，同意後才能繼續使用服務。",
@@ -222,187 +423,320 @@ def _send_terms(api: MessagingApi, reply_token: str):
                                           "text": TOS_CONFIRM_TEXT}, "style": "primary"}
         ]}
     }
-    api.reply_message(ReplyMessageRequest(
-        reply_token=reply_token,
-        messages=[FlexMessage(
-            alt_text="請先詳閱並同意《票速通服務條款》繼續服務。", contents=FlexContainer.from_dict(bubble))]
-    ))
+
+
+def _send_terms(ctx: MessageContext):
+    ctx.reply(_terms_messages())
 
 # ────────────────────────────
 # MessageEvent
 # ────────────────────────────
 
 
+router = Router(observer=lambda name, seconds: HANDLER_SECONDS.observe(seconds, name))
+
+
+def _is_manager(ctx: MessageContext) -> bool:
+    return ctx.uid in manager_user_ids
+
+
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event: MessageEvent):
-    global auto_reply
-    text = event.message.text.strip()
-    uid = event.source.user_id
-
-    with ApiClient(configuration) as cli:
-        api = MessagingApi(cli)
-
-        # ① 同意條款
-        if text == TOS_CONFIRM_TEXT:
-            accepted_terms_users.add(uid)
-            save_accepted_users()
-            _safe_reply(api, event.reply_token,
-                        "✅ 已收到您的同意條款！並了解自我權益。請重新點「填寫預訂單」開始預約。")
-            return
-
-        # ② 演唱會代操
-        if text == "[!!!]演唱會代操":
-            carousel = FlexContainer.from_dict(
-                {"type": "carousel", "contents": CONCERT_BUBBLES})
-            api.reply_message(ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[
-                    TextMessage(text=KEYWORD_REPLIES[text]),
-                    FlexMessage(alt_text="演唱會列表", contents=carousel)
-                ]
-            ))
-            return
-
-        # ③ 互動教學（FlexMessage 四按鈕）
-        if text == "[!!!]票速通使用教學":
-            teach = {
-                "type": "bubble",
-                "body": {"type": "box", "layout": "vertical", "spacing": "sm", "contents": [
-                    {"type": "text", "text": "📘 您想要進一步了解什麼？",
-                        "weight": "bold", "size": "md"}
-                ]},
-                "footer": {"type": "box", "layout": "vertical", "spacing": "sm", "contents": [
-                    {"type": "button", "action": {"type": "message",
-                                                "label": "常見Q&A", "text": "常見問題Q&A"}, "style": "primary"},
-                    {"type": "button", "action": {"type": "message",
-                                                "label": "預約演唱會教學", "text": "怎麼預約演唱會？"}, "style": "primary"},
-                    {"type": "button", "action": {"type": "message",
-                                                "label": "集點卡是什麼？", "text": "集點卡可以幹嘛？"}, "style": "primary"},
-                    {"type": "button", "action": {"type": "message",
-                                                "label": "我都學會了", "text": "我都會了！"}, "style": "primary"},
-                ]}
-            }
-            api.reply_message(ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[FlexMessage(
-                    alt_text="互動教學", contents=FlexContainer.from_dict(teach))]
-            ))
-            return
-
-        # 教學選項
-        if text == "常見問題Q&A":
-            _safe_reply(api, event.reply_token,
-                        "🧾 常見Q&A：\n"
-                        "Q：為什麼要同意條款？\n"
-                        "A：同意條款是為了保障您的權益，並確保您了解服務流程和費用結構。\n"
-                        "   條款中明確說明了代購流程、費用計算方式以及您的權益。\n\n"
-                        
-                        "Q：如果我不同意條款會怎樣？\n"
-                        "A：如果您不同意條款，則無法使用票速通的代購服務。\n"
-                        "   我們建議您仔細閱讀條款內容，並在同意後再進行預訂。\n\n"
-                        
-                        "Q：為什麼要填寫預訂單？\n"
-                        "A：填寫預訂單是為了讓我們能夠準確記錄您的需求，並在演唱會開售時優先通知您。\n"
-                        "您所支付之票款皆流向官方售票系統，代購費由@票速通另行收取。"
-                        "   這樣可以確保您能夠順利參與代購流程。\n\n"
-                        
-                        "Q：代購費用是如何計算的？\n"
-                        "A：代購費用是根據雙方事先約定的金額收取，並且與票面價格分開計算。\n"
-                        "   這樣可以確保您只支付實際的代購服務費用，而不會有額外的隱藏費用。\n\n"
-                        
-                        "Q：購票後需要做什麼？\n"
-                        "A：購票後，您需要在規定時間內完成付款。\n"
-                        
-                        "Q：購票後，帳號該怎麼辦？\n"
-                        "A：購票後，若需等到開演前五天才能取票，我們會將含有「您所委託的票券」之帳號所有權轉交給您。\n"
-                        "   • 帳號與密碼由您保管，直到您完成取票後，帳號才交還給我們。\n"
-                        "   • 轉交期間如因多地同時登入、系統安全檢測（如 Google 驗證碼）、手機認證碼等因素導致帳號異常，\n"
-                        "     本票速通概不負責，請您務必妥善保管並配合驗證程序。\n\n"
-                        
-                        "Q：我會擔心我的票，該怎麼辦？\n"
-                        "A：請詳細看上題問答。\n若是可當下取票，我們將在您付款後，提供相關取票資訊給您。\n" 
-
-                        "Q：代購服務有什麼保障？\n"
-                        "A：我們的代購服務以誠信為本，並且遵循相關法律法規。\n"
-                        "   我們會確保您支付的費用是合理的，並且在代購成功後提供必要的協助。\n\n"
-                        
-                        "Q：如果我不滿意代購服務怎麼辦？\n"
-                        "A：如果您對代購服務有任何不滿意的地方，請隨時聯絡我們的客服。\n"
-                        "   我們會盡快處理您的問題，並提供必要的協助。\n\n"
-                        
-                        "Q：如果我有問題該怎麼辦？\n"
-                        "A：如果您在使用過程中有任何問題，請隨時聯絡我們的客服。\n"
-                        "   我們會盡快回覆您的問題，並提供必要的協助。\n\n"
-                        
-                        "Q：代購流程是否合法？\n"
-                        "A：是的，在法理上屬於「純粹行紀委託，，不涉及任何超票面價買賣」──\n"
-                        "我們只接「尚未開賣之演唱會門票事前代購」，絕無事後加價販售演唱會門票。\n並且在開賣前，雙方已經約定好代購費用，並且在代購成功後才會進行付款。\n"
-                        "法規符合\n"
-                        "《社會秩序維護法》第 64-2 條：僅針對「非供自用而加價轉售」行為裁處，純手續費模式不適用；\n《文化創意產業發展法》第 10-1 條第 2 款：禁止「超過票面金額販售」，此處並無此情形。」"
-                    )
-            return
-        
-        if text == "怎麼預約演唱會？":
-            _safe_reply(api, event.reply_token,
-                        "🎟️ 請在「演唱會代操」點「填寫預訂單」，並以詳閱《票速通服務條款》同意條款後，即可開始使用預約服務。\n如「我要預訂：TWICE」")
-            return
-        
-        if text == "集點卡可以幹嘛？":
-            _safe_reply(api, event.reply_token, "💳 集點卡：若您有成功完成一筆訂單，將給予乙章。")
-            return
-        
-        if text == "我都會了！":
-            _safe_reply(api, event.reply_token, "🎉 已完成教學，有問題再聯絡客服！")
-            return
-
-        # ④ 其他關鍵字
-        if text in KEYWORD_REPLIES:
-            _safe_reply(api, event.reply_token, KEYWORD_REPLIES[text])
-            return
-
-        # ⑤ 填寫預訂單（此時檢查條款）
-        if text.startswith("我要預訂："):
-            if uid not in accepted_terms_users:
-                _send_terms(api, event.reply_token)
-                return
-            if uid in submitted_users:
-                _safe_reply(api, event.reply_token, "⚠️ 您已填寫過訂單，如需修改請聯絡客服。")
-            else:
-                submitted_users.add(uid)
-                _safe_reply(api, event.reply_token,
-                            "請填寫：\n演唱會：\n日期：\n票價：\n張數（上限4張）：")
-            return
-
-        # ⑥ 系統自動回覆切換
-        if text == "[系統]開啟自動回應" and uid in manager_user_ids:
-            auto_reply = True
-            _safe_reply(api, event.reply_token, "✅ 自動回應已開啟")
-            return
-        if text == "[系統]關閉自動回應" and uid in manager_user_ids:
-            auto_reply = False
-            _safe_reply(api, event.reply_token, "🛑 自動回應已關閉")
-            return
-
-        # ⑦ 自動回覆
-        if auto_reply:
-            _safe_reply(api, event.reply_token, "[@票速通] 小編暫時不在，請留言稍候。")
+    ctx = MessageContext(event, event.message.text.strip(),
+                         event.source.user_id, _safe_reply)
+    router.dispatch(ctx)
+
+
+# ① 同意條款
+@router.exact(TOS_CONFIRM_TEXT, name="consent")
+def _on_consent(ctx: MessageContext):
+    if not consent_store.accept(ctx.uid, TOS_VERSION):
+        ctx.reply("⚠️ 系統忙碌中，請稍後再按一次同意條款。")
+        return
+    ctx.reply("✅ 已收到您的同意條款！並了解自我權益。請重新點「填寫預訂單」開始預約。")
+
+
+# ④ 其他關鍵字
+@router.exact(*KEYWORD_REPLIES, name="keyword")
+def _on_keyword(ctx: MessageContext):
+    ctx.reply(KEYWORD_REPLIES[ctx.text])
+
+
+# ② 演唱會代操
+@router.exact("[!!!]演唱會代操", name="carousel")
+def _on_carousel(ctx: MessageContext):
+    ctx.reply(_carousel_messages())
+
+
+# ③ 互動教學（FlexMessage 四按鈕）
+@router.exact("[!!!]票速通使用教學", name="tutorial")
+def _on_tutorial(ctx: MessageContext):
+    ctx.reply(_teach_messages())
+
+
+# 教學選項
+@router.exact("常見問題Q&A", name="faq")
+def _on_faq(ctx: MessageContext):
+    ctx.reply("🧾 常見Q&A：\n"
+              "Q：為什麼要同意條款？\n"
+              "A：同意條款是為了保障您的權益，並確保您了解服務流程和費用結構。\n"
+              "   條款中明確說明了代購流程、費用計算方式以及您的權益。\n\n"
+              
+              "Q：如果我不同意條款會怎樣？\n"
+              "A：如果您不同意條款，則無法使用票速通的代購服務。\n"
+              "   我們建議您仔細閱讀條款內容，並在同意後再進行預訂。\n\n"
+              
+              "Q：為什麼要填寫預訂單？\n"
+              "A：填寫預訂單是為了讓我們能夠準確記錄您的需求，並在演唱會開售時優先通知您。\n"
+              "您所支付之票款皆流向官方售票系統，代購費由@票速通另行收取。"
+              "   這樣可以確保您能夠順利參與代購流程。\n\n"
+              
+              "Q：代購費用是如何計算的？\n"
+              "A：代購費用是根據雙方事先約定的金額收取，並且與票面價格分開計算。\n"
+              "   這樣可以確保您只支付實際的代購服務費用，而不會有額外的隱藏費用。\n\n"
+              
+              "Q：購票後需要做什麼？\n"
+              "A：購票後，您需要在規定時間內完成付款。\n"
+              
+              "Q：購票後，帳號該怎麼辦？\n"
+              "A：購票後，若需等到開演前五天才能取票，我們會將含有「您所委託的票券」之帳號所有權轉交給您。\n"
+              "   • 帳號與密碼由您保管，直到您完成取票後，帳號才交還給我們。\n"
+              "   • 轉交期間如因多地同時登入、系統安全檢測（如 Google 驗證碼）、手機認證碼等因素導致帳號異常，\n"
+              "     本票速通概不負責，請您務必妥善保管並配合驗證程序。\n\n"
+              
+              "Q：我會擔心我的票，該怎麼辦？\n"
+              "A：請詳細看上題問答。\n若是可當下取票，我們將在您付款後，提供相關取票資訊給您。\n" 
+
+              "Q：代購服務有什麼保障？\n"
+              "A：我們的代購服務以誠信為本，並且遵循相關法律法規。\n"
+              "   我們會確保您支付的費用是合理的，並且在代購成功後提供必要的協助。\n\n"
+              
+              "Q：如果我不滿意代購服務怎麼辦？\n"
+              "A：如果您對代購服務有任何不滿意的地方，請隨時聯絡我們的客服。\n"
+              "   我們會盡快處理您的問題，並提供必要的協助。\n\n"
+              
+              "Q：如果我有問題該怎麼辦？\n"
+              "A：如果您在使用過程中有任何問題，請隨時聯絡我們的客服。\n"
+              "   我們會盡快回覆您的問題，並提供必要的協助。\n\n"
+              
+              "Q：代購流程是否合法？\n"
+              "A：是的，在法理上屬於「純粹行紀委託，，不涉及任何超票面價買賣」──\n"
+              "我們只接「尚未開賣之演唱會門票事前代購」，絕無事後加價販售演唱會門票。\n並且在開賣前，雙方已經約定好代購費用，並且在代購成功後才會進行付款。\n"
+              "法規符合\n"
+              "《社會秩序維護法》第 64-2 條：僅針對「非供自用而加價轉售」行為裁處，純手續費模式不適用；\n《文化創意產業發展法》第 10-1 條第 2 款：禁止「超過票面金額販售」，此處並無此情形。」"
+              )
+
+
+@router.exact("怎麼預約演唱會？", name="howto_booking")
+def _on_howto_booking(ctx: MessageContext):
+    ctx.reply("🎟️ 請在「演唱會代操」點「填寫預訂單」，並以詳閱《票速通服務條款》同意條款後，即可開始使用預約服務。\n如「我要預訂：TWICE」")
+
+
+@router.exact("集點卡可以幹嘛？", name="howto_points")
+def _on_howto_points(ctx: MessageContext):
+    ctx.reply("💳 集點卡：若您有成功完成一筆訂單，將給予乙章。")
+
+
+@router.exact("我都會了！", name="tutorial_done")
+def _on_tutorial_done(ctx: MessageContext):
+    ctx.reply("🎉 已完成教學，有問題再聯絡客服！")
+
+
+# ⑤ 填寫預訂單（此時檢查條款）
+@router.prefix("我要預訂：", name="booking")
+def _on_booking(ctx: MessageContext):
+    uid = ctx.uid
+    concert = catalog.current().lookup(ctx.text[len("我要預訂："):])
+    if concert is None:
+        ctx.reply("⚠️ 查無此演唱會，請從「演唱會代操」列表點選「填寫預訂單」。")
+        return
+    if not concert.bookable:
+        ctx.reply(f"⚠️ 「{concert.title}」已停止預訂。")
+        return
+    if not consent_store.has_accepted(uid, TOS_VERSION):
+        _send_terms(ctx)
+        return
+    if state.is_submitted(uid):
+        ctx.reply("⚠️ 您已填寫過訂單，如需修改請聯絡客服。")
+        return
+    # 預訂單寫入成功才算「已填寫」；範本過期或還沒填完，再點一次就重送範本
+    state.set_pending_order(uid, concert.keyword, ORDER_FORM_TTL)
+    ctx.reply(ORDER_FORM_TEMPLATE)
+
+
+# ⑤-2 收預訂單：內容至少有兩欄才當成預訂單（還沒送出過訂單的人才收）
+def _is_order_form(ctx: MessageContext) -> bool:
+    return looks_like_order_form(ctx.text) and (
+        state.pending_order(ctx.uid) is not None or not state.is_submitted(ctx.uid))
+
+
+@router.fallback(name="order_form", guard=_is_order_form)
+def _on_order_form(ctx: MessageContext):
+    keyword = state.pending_order(ctx.uid)
+    if keyword is None:
+        # 範本已過期：請使用者重新點，不讓填好的單默默掉進自動回覆
+        ORDERS_TOTAL.inc("expired")
+        ctx.reply("⏰ 預訂單已逾時，請從「演唱會代操」列表重新點選「填寫預訂單」後再傳送。")
+        return
+    concert = catalog.current().lookup(keyword)
+    if concert is None or not concert.bookable:
+        ORDERS_TOTAL.inc("closed")
+        state.clear_pending_order(ctx.uid)
+        ctx.reply("⚠️ 此演唱會已停止預訂，如有疑問請聯絡客服。")
+        return
+    try:
+        order = parse_order(ctx.text, concert, catalog.current())
+    except OrderError as e:
+        ORDERS_TOTAL.inc("invalid")
+        ctx.reply(f"⚠️ 預訂單有誤，請修正後重新傳送：\n{e}\n\n{ORDER_FORM_TEMPLATE}")
+        return
+    if not order_store.add(ctx.uid, order, ctx.text):
+        ORDERS_TOTAL.inc("error")
+        ctx.reply("⚠️ 系統忙碌中，請稍後再傳送一次預訂單。")
+        return
+    ORDERS_TOTAL.inc("accepted")
+    state.mark_submitted(ctx.uid)
+    state.add_booking(ctx.uid, concert.keyword)
+    state.clear_pending_order(ctx.uid)
+    ctx.reply(f"✅ 已收到您的預訂單！\n演唱會：{concert.title}\n日期：{order.date}\n"
+              f"票價：{order.price:,}\n張數：{order.quantity}\n小編會盡快與您聯繫。")
+
+
+# ⑥ 系統自動回覆切換（僅管理者）
+@router.exact("[系統]開啟自動回應", name="auto_reply_on", guard=_is_manager)
+def _on_auto_reply_on(ctx: MessageContext):
+    state.set_flag("auto_reply", True)
+    ctx.reply("✅ 自動回應已開啟")
+
+
+@router.exact("[系統]關閉自動回應", name="auto_reply_off", guard=_is_manager)
+def _on_auto_reply_off(ctx: MessageContext):
+    state.set_flag("auto_reply", False)
+    ctx.reply("🛑 自動回應已關閉")
+
+
+@router.exact("[系統]訂單統計", name="order_summary", guard=_is_manager)
+def _on_order_summary(ctx: MessageContext):
+    summary = order_store.summary()
+    if not summary:
+        ctx.reply("目前沒有預訂單。")
+        return
+    ctx.reply("📋 預訂單統計\n" + "\n".join(
+        f"➣ {keyword}：{row['orders']} 筆，共 {row['tickets']} 張"
+        for keyword, row in summary.items()))
+
+
+# 開賣通知：「[系統]開賣通知：TWICE」群發給所有預訂該場的使用者（僅管理者）
+@router.prefix("[系統]開賣通知：", name="sale_notice", guard=_is_manager)
+def _on_sale_notice(ctx: MessageContext):
+    concert = catalog.current().lookup(ctx.text[len("[系統]開賣通知："):])
+    if concert is None:
+        ctx.reply("⚠️ 查無此演唱會")
+        return
+    notice = (f"🎫 {concert.title} 即將開賣！\n"
+              f"日期：{concert.date}\n地點：{concert.location}\n"
+              "小編會在購票當天與您聯繫，請留意訊息。")
+    job_id = fanout_job_id(concert.keyword, notice)
+    recipients = fanout.pending(job_id, state.booked_users(concert.keyword))
+    if not recipients:
+        ctx.reply(f"「{concert.title}」沒有待通知的預訂者。")
+        return
+    ctx.reply(f"📣 開始通知「{concert.title}」預訂者 {len(recipients)} 人…")
+    manager = ctx.uid
+    fanout.start(job_id, recipients, [TextMessage(text=notice)],
+                 on_done=lambda r: outbound.push(manager, [TextMessage(
+                     text=f"📣 {concert.title} 通知完成：成功 {r.get('sent', 0)} 人，"
+                          f"失敗 {r.get('failed', 0)} 人（{r['status']}）")]))
+
+
+# ⑦ 自動回覆
+@router.fallback(name="fallthrough")
+def _on_fallthrough(ctx: MessageContext):
+    if state.get_flag("auto_reply", False):
+        ctx.reply("[@票速通] 小編暫時不在，請留言稍候。")
 
 # ────────────────────────────
 # 安全回覆
 # ────────────────────────────
 
 
-def _safe_reply(api: MessagingApi, reply_token: str, message):
+def as_messages(message) -> list:
+    if isinstance(message, str):
+        return [TextMessage(text=message)]
+    if isinstance(message, list):
+        return message
+    return [message]
+
+
+def _safe_reply(ctx: MessageContext, message):
+    # 交给 outbound 排程：限流、重试，reply token 过期就改 push
     try:
-        if isinstance(message, str):
-            api.reply_message(ReplyMessageRequest(
-                reply_token=reply_token, messages=[TextMessage(text=message)]))
-        else:
-            api.reply_message(ReplyMessageRequest(
-                reply_token=reply_token, messages=[message]))
+        outbound.reply(ctx.reply_token, as_messages(message), user_id=ctx.uid,
+                       issued_at=ctx.event.timestamp / 1000 if ctx.event.timestamp else None)
     except Exception as e:
         logging.error(f"[Reply 失敗] {e}")
 
 
+@app.route("/stats/pool", methods=["GET"])
+def pool_stats():
+    return jsonify(line_client.stats())
+
+
+@app.route("/stats/routes", methods=["GET"])
+def route_stats():
+    return jsonify(router.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    metrics.start()
+    return Response(metrics.render(),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/stats/outbound", methods=["GET"])
+def outbound_stats():
+    return jsonify(outbound.stats())
+
+
+@app.route("/stats/dedup", methods=["GET"])
+def dedup_stats():
+    return jsonify(event_dedup.stats())
+
+
+@app.route("/stats/startup", methods=["GET"])
+def startup_stats():
+    return jsonify({"phases": startup.phases(),
+                    "boot_to_first_reply": startup.boot_to_first_reply()})
+
+
+@app.route("/admin/orders.csv", methods=["GET"])
+def export_orders():
+    # ?concert=TWICE 只匯出單場；?since=<id> 只匯出該 id 之後的（增量匯出）
+    # 只收 Authorization header；放在網址裡會被 access log 記下來
+    auth = request.headers.get("Authorization", "")
+    token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+    if not ADMIN_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        abort(403)
+    concert = request.args.get("concert") or None
+    since = request.args.get("since", "0")
+    if not (since.isascii() and since.isdigit()):   # 「²」之類 isdigit 也算
+        abort(400)
+    return Response(order_store.export_csv(concert, int(since)),
+                    content_type="text/csv; charset=utf-8",
+                    headers={"Content-Disposition": "attachment; filename=orders.csv"})
+
+
+metrics.gauge("ticketbot_boot_to_first_reply_seconds",
+              "Seconds from process start to the first successful reply",
+              startup.boot_to_first_reply, merge="max")
+
+if WARM_UP:
+    # async 版用自己的 aiohttp session 暖機（AsyncBot.open），同步連線池只在少數 push 補送時才用到
+    warm_up(connect=WARM_UP_CONNECT and startup.server != "async")
+startup.mark("ready")
+
 if __name__ == "__main__":
     app.run("0.0.0.0", int(os.environ.get("PORT", 5001)), debug=True)
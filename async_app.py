@@ -0,0 +1,332 @@
+# async_app.py — 票速通 asyncio 版 webhook（aiohttp + AsyncMessagingApi）
+#
+# 路由、條款、目錄、狀態、去重、metrics 全部沿用 app.py，只換掉送訊息的方式：
+#   - handler 照舊同步執行（會碰 SQLite / fsync），丟到有上限的 thread pool，不卡 event loop
+#   - handler 裡的 ctx.reply() 只收集訊息，reply_message 以 coroutine 在共用的 aiohttp session 上送出
+#   - 同一使用者的事件依序處理，不同使用者同時進行；上千個 reply 可以同時在路上
+#
+# 啟動：
+#   python async_app.py
+#   gunicorn async_app:create_app --worker-class aiohttp.GunicornWebWorker
+# Flask 版（app:app）照舊可用，兩者擇一。
+
+import os
+import hmac
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.messaging import (
+    Configuration, AsyncApiClient, AsyncMessagingApi, ReplyMessageRequest
+)
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+
+import startup
+startup.server = "async"
+import app as bot  # noqa: E402
+from router import MessageContext
+from outbound import TokenBucket, PRIORITY_FALLBACK, describe_error
+
+# ────────────────────────────
+# 设定
+# ────────────────────────────
+# 同时在路上的 HTTP 连线上限（aiohttp connector limit）
+ASYNC_POOL_SIZE = int(os.environ.get("ASYNC_POOL_SIZE", "200"))
+# 尚未处理完的事件上限，超过回 503 让 LINE 稍后重送
+ASYNC_MAX_PENDING = int(os.environ.get("ASYNC_MAX_PENDING", "5000"))
+# 执行同步 handler 的 thread 数
+ASYNC_HANDLER_THREADS = int(os.environ.get("ASYNC_HANDLER_THREADS", "16"))
+
+_reply_bucket = TokenBucket(bot.OUTBOUND_RATES["reply"])
+_executor = ThreadPoolExecutor(ASYNC_HANDLER_THREADS, thread_name_prefix="handler")
+# 共用去重（DEDUP_SHARED=1）要寫 SQLite、可能等別的 worker 的鎖；獨立的 pool，不排在 handler 後面
+_dedup_executor = ThreadPoolExecutor(4, thread_name_prefix="dedup")
+
+
+async def _dedup(method, *args):
+    """event_dedup 的 claim / release；有共用狀態時丟到 thread，不卡 event loop。"""
+    if not bot.event_dedup.shared:
+        return method(*args)
+    return await asyncio.get_running_loop().run_in_executor(_dedup_executor, method, *args)
+
+
+class _Collector:
+    """handler 呼叫 ctx.reply() 時先收起來，回到 event loop 再一次送出。"""
+    __slots__ = ("messages",)
+
+    def __init__(self):
+        self.messages: list = []
+
+    def __call__(self, ctx: MessageContext, message):
+        self.messages.extend(bot.as_messages(message))
+
+
+class AsyncBot:
+    def __init__(self):
+        self.api: AsyncMessagingApi | None = None
+        self._client: AsyncApiClient | None = None
+        self._tails: dict[str, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._counts = {"sent": 0, "retried": 0, "fallback": 0, "expired": 0,
+                        "failed": 0, "throttled": 0}
+
+    # ── 生命週期 ─────────────────────────────
+    async def open(self):
+        configuration = Configuration(access_token=bot.ACCESS_TOKEN,
+                                      host=os.environ.get("LINE_API_HOST") or None)
+        configuration.connection_pool_maxsize = ASYNC_POOL_SIZE
+        self._client = AsyncApiClient(configuration)
+        self.api = AsyncMessagingApi(self._client)
+        if bot.WARM_UP and bot.WARM_UP_CONNECT:
+            asyncio.get_running_loop().create_task(self._warm_connection())
+
+    async def _warm_connection(self):
+        # 跟 app.warm_up 一樣：先把 aiohttp session 的第一條連線開好
+        try:
+            await self.api.get_bot_info()
+            startup.mark("async_api_connected")
+        except Exception as e:
+            logging.warning(f"[Warm-up 連線失敗] {e}")
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=5.0)
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def stats(self) -> dict:
+        return {**self._counts, "pending": len(self._tasks), "users": len(self._tails)}
+
+    # ── 事件 ─────────────────────────────────
+    def submit(self, event) -> bool:
+        if len(self._tasks) >= ASYNC_MAX_PENDING:
+            return False
+        key = bot.event_key(event)
+        prev = self._tails.get(key)
+        task = asyncio.get_running_loop().create_task(self._run(event, prev))
+        self._tasks.add(task)
+        self._tails[key] = task
+
+        def done(t):
+            self._tasks.discard(t)
+            if self._tails.get(key) is t:
+                del self._tails[key]
+        task.add_done_callback(done)
+        return True
+
+    async def _run(self, event, prev):
+        # 同一使用者的上一則還沒處理完就先等它，保持順序
+        if prev is not None:
+            await asyncio.wait((prev,))
+        try:
+            await self.handle(event)
+        except Exception:
+            await _dedup(bot.event_dedup.release, getattr(event, "webhook_event_id", None))
+            logging.exception("[Async 事件處理失敗]")
+
+    async def handle(self, event):
+        if not (isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent)):
+            return
+        collector = _Collector()
+        ctx = MessageContext(event, event.message.text.strip(), event.source.user_id, collector)
+        await asyncio.get_running_loop().run_in_executor(_executor, bot.router.dispatch, ctx)
+        if collector.messages:
+            await self.reply(ctx, collector.messages)
+
+    # ── 送出 ─────────────────────────────────
+    def _event(self, name: str):
+        self._counts[name] += 1
+        bot.OUTBOUND_EVENTS.inc(name)
+
+    async def reply(self, ctx: MessageContext, messages: list):
+        issued_at = ctx.event.timestamp / 1000 if ctx.event.timestamp else time.time()
+        deadline = issued_at + bot.REPLY_TOKEN_TTL
+        attempts = 0
+        maybe_delivered = False
+        policy = bot.outbound.policy
+        # flex_cache 的訊息已預先序列化（Prebuilt），不在 event loop 上重轉 dict
+        request = ReplyMessageRequest.construct(reply_token=ctx.reply_token, messages=messages)
+        while True:
+            if time.time() >= deadline:
+                action = "expired"
+                break
+            wait = _reply_bucket.reserve()
+            if wait > 0:
+                self._event("throttled")
+                await asyncio.sleep(wait)
+
+            t0 = time.perf_counter()
+            retry_after = None
+            invalid_token = False
+            try:
+                await self.api.reply_message(request)
+                status = 200
+            except Exception as e:
+                status, retry_after, invalid_token = describe_error(e, "reply")
+                logging.warning(f"[reply 失敗] HTTP {status} {getattr(e, 'reason', None) or e}")
+            attempts += 1
+            maybe_delivered |= status == 0
+            bot.observe_send("reply", str(status) if status else "error",
+                             time.perf_counter() - t0)
+
+            # 重試 / 改 push 的規則與同步排程（outbound.RetryPolicy）相同
+            action, delay = policy.decide("reply", status, attempts, retry_after=retry_after,
+                                          deadline=deadline, invalid_token=invalid_token,
+                                          maybe_delivered=maybe_delivered)
+            if action != "retry":
+                break
+            self._event("retried")
+            await asyncio.sleep(delay)
+
+        if action == "sent":
+            self._event("sent")
+            return
+        if action == "expired":
+            self._event("expired")
+        if action == "failed":
+            self._event("failed")
+            return
+
+        # reply token 用不了：交給同步排程以 push 補送（少見路徑，帶 retry key 不會重複）
+        if bot.OUTBOUND_PUSH_FALLBACK and ctx.uid and not maybe_delivered:
+            self._event("fallback")
+            bot.outbound.push(ctx.uid, messages, priority=PRIORITY_FALLBACK)
+        else:
+            self._event("failed")
+
+
+async_bot = AsyncBot()
+bot.metrics.gauge("ticketbot_async_pending_events", "Events being handled by the asyncio server",
+                  async_bot.pending)
+
+# ────────────────────────────
+# Webhook 入口
+# ────────────────────────────
+
+
+async def callback(request: web.Request):
+    bot.metrics.start()
+    signature = request.headers.get("X-Line-Signature", "")
+    body = await request.text()
+    try:
+        events = bot.handler.parser.parse(body, signature)
+    except InvalidSignatureError:
+        bot.SIGNATURE_FAILURES.inc()
+        raise web.HTTPBadRequest()
+
+    for event in events:
+        event_id = getattr(event, "webhook_event_id", None)
+        delivery = getattr(event, "delivery_context", None)
+        if not await _dedup(bot.event_dedup.claim, event_id,
+                            getattr(delivery, "is_redelivery", False)):
+            bot.EVENTS_TOTAL.inc("duplicate")
+            continue
+        if async_bot.submit(event):
+            bot.EVENTS_TOTAL.inc("accepted")
+        else:
+            await _dedup(bot.event_dedup.release, event_id)
+            bot.EVENTS_TOTAL.inc("rejected")
+            logging.warning("[Async 待處理事件已滿] 回 503 讓 LINE 稍後重送")
+            raise web.HTTPServiceUnavailable()
+    return web.Response(text="OK")
+
+
+async def metrics_endpoint(request: web.Request):
+    bot.metrics.start()
+    return web.Response(body=bot.metrics.render().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def route_stats(request: web.Request):
+    return web.json_response(bot.router.stats())
+
+
+async def outbound_stats(request: web.Request):
+    return web.json_response({"async": async_bot.stats(), "scheduler": bot.outbound.stats()})
+
+
+async def dedup_stats(request: web.Request):
+    return web.json_response(bot.event_dedup.stats())
+
+
+async def startup_stats(request: web.Request):
+    return web.json_response({"phases": startup.phases(),
+                              "boot_to_first_reply": startup.boot_to_first_reply()})
+
+
+async def export_orders(request: web.Request):
+    # 與 app.export_orders 相同；讀 SQLite 交給 thread pool，邊讀邊送
+    # 只收 Authorization header；放在網址裡會被 access log 記下來
+    auth = request.headers.get("Authorization", "")
+    token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+    if not bot.ADMIN_TOKEN:
+        raise web.HTTPNotFound()
+    if not hmac.compare_digest(token.encode(), bot.ADMIN_TOKEN.encode()):
+        raise web.HTTPForbidden()
+    since = request.query.get("since", "0")
+    if not (since.isascii() and since.isdigit()):   # 「²」之類 isdigit 也算
+        raise web.HTTPBadRequest()
+    concert, since_id = request.query.get("concert") or None, int(since)
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/csv; charset=utf-8",
+        "Content-Disposition": "attachment; filename=orders.csv"})
+    await response.prepare(request)
+    # SQLite 連線只能在開它的 thread 用：整個匯出在同一個 thread 跑完，片段經 queue 交回 event loop
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=8)
+    stop = threading.Event()
+
+    def produce(concert, since_id):
+        try:
+            for chunk in bot.order_store.export_csv(concert, since_id):
+                if stop.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+        finally:
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(chunks.put(None), loop).result()
+
+    producer = loop.run_in_executor(_executor, produce, concert, since_id)
+    try:
+        while (chunk := await chunks.get()) is not None:
+            await response.write(chunk.encode("utf-8"))
+    finally:
+        # 用戶端中途斷線：叫 producer 停下，清空 queue 讓卡在 put 的那次返回
+        stop.set()
+        while not chunks.empty():
+            chunks.get_nowait()
+        await producer
+    await response.write_eof()
+    return response
+
+
+async def _lifecycle(application: web.Application):
+    await async_bot.open()
+    yield
+    await async_bot.close()
+
+
+async def create_app() -> web.Application:
+    application = web.Application()
+    application.cleanup_ctx.append(_lifecycle)
+    application.router.add_post("/callback", callback)
+    application.router.add_get("/metrics", metrics_endpoint)
+    application.router.add_get("/stats/routes", route_stats)
+    application.router.add_get("/stats/outbound", outbound_stats)
+    application.router.add_get("/stats/dedup", dedup_stats)
+    application.router.add_get("/stats/startup", startup_stats)
+    application.router.add_get("/admin/orders.csv", export_orders)
+    application.router.add_static("/static", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+    return application
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), port=int(os.environ.get("PORT", 5001)))
@@ -0,0 +1,91 @@
+# bench/export_bench.py — 票速通 預訂單匯出（/admin/orders.csv）
+#
+# 在暫存目錄寫入 N 筆預訂單，分別用 Flask 與 aiohttp 版匯出，檢查筆數並計時。
+# 筆數要大於一個 chunk（500 筆），才會走到邊讀邊送的路徑。
+#
+#   python bench/export_bench.py --orders 3000 --rounds 3
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "bench-admin-token"
+
+
+def _rows(body: bytes) -> int:
+    return len(body.decode("utf-8-sig").strip().split("\r\n")) - 1
+
+
+def run_flask(app, rounds: int) -> list[tuple[int, float]]:
+    client = app.app.test_client()
+    results = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        r = client.get("/admin/orders.csv", headers={"Authorization": f"Bearer {TOKEN}"})
+        results.append((_rows(r.data) if r.status_code == 200 else -1, time.perf_counter() - t0))
+    return results
+
+
+def run_aiohttp(rounds: int) -> list[tuple[int, float]]:
+    import async_app
+    from aiohttp import ClientPayloadError
+    from aiohttp.test_utils import TestClient, TestServer
+
+    async def main():
+        client = TestClient(TestServer(await async_app.create_app()))
+        await client.start_server()
+        results = []
+        try:
+            for _ in range(rounds):
+                t0 = time.perf_counter()
+                r = await client.get("/admin/orders.csv",
+                                     headers={"Authorization": f"Bearer {TOKEN}"})
+                try:
+                    rows = _rows(await r.read()) if r.status == 200 else -1
+                except ClientPayloadError:      # 串流中途斷掉
+                    rows = -1
+                results.append((rows, time.perf_counter() - t0))
+        finally:
+            await client.close()
+        return results
+    return asyncio.run(main())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="order CSV export check / benchmark")
+    ap.add_argument("--orders", type=int, default=3000)
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="export-bench-")
+    os.chdir(workdir)
+    os.environ.update({
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-token", "LINE_CHANNEL_SECRET": "bench-secret",
+        "LINE_API_HOST": "http://127.0.0.1:9", "WARM_UP_CONNECT": "0", "ADMIN_TOKEN": TOKEN,
+    })
+    sys.path.insert(0, REPO)
+    import app
+    from orders import Order
+
+    t0 = time.perf_counter()
+    for i in range(args.orders):
+        app.order_store.add(f"U{i:032x}", Order("TWICE", "2026/03/21", 4800, 1 + i % 4),
+                            f"演唱會：TWICE\n張數：{1 + i % 4}", wait=i == args.orders - 1)
+    print(f"寫入 {args.orders:,} 筆：{time.perf_counter() - t0:.2f} s（workdir {workdir}）")
+
+    ok = True
+    for name, results in (("flask", run_flask(app, args.rounds)),
+                          ("aiohttp", run_aiohttp(args.rounds))):
+        for rows, seconds in results:
+            status = "OK" if rows == args.orders else "不完整"
+            ok &= rows == args.orders
+            print(f"  {name:<8} {rows:>8,} 筆 {seconds * 1000:8.1f} ms  {status}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# bench/line_stub.py — 本地假的 Messaging API（壓測用）
+#
+#   python bench/line_stub.py --port 18080 --latency-ms 80 --error-rate 0.01
+
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubState:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 500):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.statuses = Counter()
+        self.messages = 0
+
+    def record(self, path: str, status: int, n_messages: int):
+        with self._lock:
+            self.calls[path] += 1
+            self.statuses[status] += 1
+            if status == 200:
+                self.messages += n_messages
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "statuses": {str(k): v for k, v in self.statuses.items()},
+                "messages": self.messages,
+            }
+
+
+def _make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            try:
+                payload = json.loads(raw) if raw else {}
+            except ValueError:
+                payload = {}
+            delay = state.latency_ms + random.uniform(0, state.jitter_ms)
+            if delay > 0:
+                time.sleep(delay / 1000)
+
+            messages = payload.get("messages") or []
+            path = self.path.split("?")[0]
+            if state.error_rate and random.random() < state.error_rate:
+                status = state.error_status
+                body = {"message": "injected error"}
+            elif path.endswith(("/message/reply", "/message/push")):
+                status = 200
+                body = {"sentMessages": [{"id": str(i), "quoteToken": "stub"}
+                                         for i in range(max(len(messages), 1))]}
+            elif path.endswith("/bot/info"):
+                status = 200
+                body = {"userId": "Ubench", "basicId": "@bench", "displayName": "bench",
+                        "chatMode": "bot", "markAsReadMode": "auto"}
+            else:
+                status = 200
+                body = {}
+            state.record(path, status, len(messages))
+
+            out = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(out)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(port: int = 0, state: StubState | None = None):
+    state = state or StubState()
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="line-stub", daemon=True).start()
+    return server, state
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local Messaging API stub")
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-status", type=int, default=500)
+    args = ap.parse_args()
+    state = StubState(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status)
+    server, _ = start_stub(args.port, state)
+    print(f"LINE API stub on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(state.snapshot(), ensure_ascii=False))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
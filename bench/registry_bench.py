@@ -0,0 +1,114 @@
+# bench/registry_bench.py — 票速通 user ID 名單：set[str] / dict vs user_registry
+#
+# 比較記憶體（tracemalloc）、建立時間、查詢時間（命中 / 未命中），以及 mmap 載入。
+#
+#   python bench/registry_bench.py --users 10000,100000,1000000 --lookups 200000
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from user_registry import UserIdSet, UserIdMap  # noqa: E402
+
+
+def make_ids(n: int, seed: int) -> list[str]:
+    rnd = random.Random(seed)
+    return ["U%032x" % rnd.getrandbits(128) for _ in range(n)]
+
+
+def measure_build(build):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    obj = build()
+    seconds = time.perf_counter() - t0
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size, seconds
+
+
+def measure_lookup(contains, probes: list[str]) -> float:
+    t0 = time.perf_counter()
+    for uid in probes:
+        contains(uid)
+    return (time.perf_counter() - t0) / len(probes) * 1e9
+
+
+def run(n: int, lookups: int, seed: int) -> dict:
+    ids = make_ids(n, seed)
+    rnd = random.Random(seed + 1)
+    hits = [rnd.choice(ids) for _ in range(lookups)]
+    misses = make_ids(lookups, seed + 2)
+    # 量測時 ID 字串本身要重新產生，不然會算到 ids 共用的那份
+    fresh = lambda: (u[:1] + u[1:] for u in ids)  # noqa: E731
+
+    results = {}
+    cases = {
+        "set[str]": (lambda: set(fresh()), lambda s: s.__contains__),
+        "UserIdSet": (lambda: UserIdSet(fresh()), lambda s: s.__contains__),
+        "dict[str,str]": (lambda: {u: "v1" for u in fresh()}, lambda d: d.__contains__),
+        "UserIdMap": (lambda: UserIdMap((u, "v1") for u in fresh()), lambda m: m.__contains__),
+    }
+    for name, (build, contains_of) in cases.items():
+        obj, size, build_s = measure_build(build)
+        contains = contains_of(obj)
+        results[name] = {
+            "bytes": size,
+            "bytes_per_id": round(size / n, 1),
+            "build_s": round(build_s, 4),
+            "hit_ns": round(measure_lookup(contains, hits)),
+            "miss_ns": round(measure_lookup(contains, misses)),
+        }
+        del obj, contains
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ids.bin")
+        UserIdSet(ids).save(path)
+        obj, size, load_s = measure_build(lambda: UserIdSet.load(path, use_mmap=True))
+        results["UserIdSet (mmap)"] = {
+            "bytes": size,
+            "bytes_per_id": round(size / n, 1),
+            "build_s": round(load_s, 4),
+            "hit_ns": round(measure_lookup(obj.__contains__, hits)),
+            "miss_ns": round(measure_lookup(obj.__contains__, misses)),
+            "file_bytes": os.path.getsize(path),
+        }
+        del obj
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="user ID registry memory / lookup benchmark")
+    ap.add_argument("--users", default="10000,100000")
+    ap.add_argument("--lookups", type=int, default=100000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="write results as JSON")
+    args = ap.parse_args()
+
+    report = {}
+    for n in (int(x) for x in args.users.split(",") if x):
+        results = run(n, args.lookups, args.seed)
+        report[n] = results
+        print(f"── {n:,} 個 user ID")
+        print(f"  {'':<18} {'MiB':>8} {'B/ID':>7} {'建立 s':>8} {'命中 ns':>8} {'未命中 ns':>9}")
+        for name, r in results.items():
+            print(f"  {name:<18} {r['bytes'] / 2**20:8.2f} {r['bytes_per_id']:7.1f} "
+                  f"{r['build_s']:8.3f} {r['hit_ns']:8d} {r['miss_ns']:9d}")
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# bench/run_bench.py — 票速通 壓測
+#
+# 啟動本地 LINE API stub，把 app.py 分別用 Flask dev server / gunicorn 跑起來
+# （aiohttp = async_app.py 的 asyncio 版），
+# 以設定的併發送出簽好名的 webhook，輸出每條路由的 throughput 與 p50/p95/p99。
+#
+#   python bench/run_bench.py --servers flask,gunicorn --requests 300 --concurrency 32 \
+#       --latency-ms 80 --out bench/results/latest.json --baseline bench/results/prev.json
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from line_stub import StubState, start_stub
+from webhook_gen import SCENARIOS, signed_request, user_id
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "bench-channel-secret"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def _summary(latencies: list[float]) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+        "p50_ms": round(_percentile(values, 0.50), 3),
+        "p95_ms": round(_percentile(values, 0.95), 3),
+        "p99_ms": round(_percentile(values, 0.99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0,
+    }
+
+
+def _spawn(server: str, port: int, workdir: str, stub_url: str, args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-token",
+        "LINE_CHANNEL_SECRET": SECRET,
+        "LINE_API_HOST": stub_url,
+        "BOSS_USER_ID": user_id(0),
+        "EVENT_WORKERS": str(args.event_workers),
+        "CONSENT_STORE_PATH": os.path.join(workdir, "accepted_users.jsonl"),
+        "STATE_DB_PATH": os.path.join(workdir, "bot_state.sqlite3"),
+        "PYTHONPATH": REPO,
+    })
+    if server == "flask":
+        cmd = [sys.executable, "-m", "flask", "--app", "app", "run",
+               "--host", "127.0.0.1", "--port", str(port), "--with-threads"]
+    elif server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "app:app",
+               "-b", f"127.0.0.1:{port}",
+               "-w", str(args.gunicorn_workers), "--threads", str(args.gunicorn_threads),
+               "--log-level", "warning"]
+    elif server == "aiohttp":
+        cmd = [sys.executable, "-m", "gunicorn", "async_app:create_app",
+               "-b", f"127.0.0.1:{port}", "-w", str(args.gunicorn_workers),
+               "--worker-class", "aiohttp.GunicornWebWorker", "--log-level", "warning"]
+    else:
+        raise ValueError(server)
+    return subprocess.Popen(cmd, cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _wait_ready(port: int, proc: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(proc.stderr.read().decode("utf-8", "replace")[-2000:])
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/stats/routes")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on :{port} not ready after {timeout}s")
+
+
+def _drive(port: int, jobs: list[tuple[str, str]], concurrency: int):
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+
+    def send(job):
+        route, uid = job
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        body, headers = signed_request(SECRET, route, uid)
+        t0 = time.perf_counter()
+        try:
+            conn.request("POST", "/callback", body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            local.conn = None
+            status = 0
+        dt = (time.perf_counter() - t0) * 1000
+        with lock:
+            latencies[route].append(dt)
+            statuses[route][status] += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, jobs))
+    elapsed = time.perf_counter() - t0
+    return elapsed, latencies, statuses
+
+
+def _settle(stub: StubState, timeout: float = 10.0):
+    # 背景 worker 模式下 /callback 先回 200，等 reply 都打到 stub 再收數字
+    last, stable_since = -1, time.monotonic()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        n = sum(stub.snapshot()["calls"].values())
+        if n != last:
+            last, stable_since = n, time.monotonic()
+        elif time.monotonic() - stable_since > 0.5:
+            return
+        time.sleep(0.1)
+
+
+def run_server(server: str, args, stub: StubState, stub_url: str) -> dict:
+    port = _free_port()
+    with tempfile.TemporaryDirectory(prefix=f"bench-{server}-") as workdir:
+        proc = _spawn(server, port, workdir, stub_url, args)
+        try:
+            _wait_ready(port, proc)
+            users = [user_id(i + 1) for i in range(args.users)]
+            # 預訂路由要先同意條款，否則只會量到條款 bubble
+            _drive(port, [("consent", u) for u in users], args.concurrency)
+            _settle(stub)
+            before = stub.snapshot()
+
+            jobs = []
+            for route in args.routes:
+                for i in range(args.requests):
+                    if route == "consent":
+                        uid = user_id(10_000_000 + len(jobs))   # 新使用者才會寫入
+                    else:
+                        uid = random.choice(users)
+                    jobs.append((route, uid))
+            random.shuffle(jobs)
+            elapsed, latencies, statuses = _drive(port, jobs, args.concurrency)
+            _settle(stub)
+            after = stub.snapshot()
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    replies = sum(after["calls"].values()) - sum(before["calls"].values())
+    return {
+        "requests": len(jobs),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(jobs) / elapsed, 1) if elapsed else 0.0,
+        "overall": _summary(all_latencies),
+        "routes": {
+            route: {**_summary(latencies[route]),
+                    "statuses": {str(k): v for k, v in statuses[route].items()}}
+            for route in args.routes
+        },
+        "stub_calls": replies,
+    }
+
+
+def _compare(current: dict, baseline: dict, threshold: float):
+    print(f"\n── 與 baseline 比較（>{threshold:.0%} 視為退步）")
+    regressions = 0
+    for server, res in current["results"].items():
+        base = baseline.get("results", {}).get(server)
+        if not base:
+            continue
+        pairs = [("throughput_rps", res["throughput_rps"], base["throughput_rps"], True)]
+        for route, r in res["routes"].items():
+            b = base["routes"].get(route)
+            if b:
+                pairs.append((f"{route}.p95_ms", r["p95_ms"], b["p95_ms"], False))
+        for name, now, then, higher_is_better in pairs:
+            if not then:
+                continue
+            change = (now - then) / then
+            worse = -change if higher_is_better else change
+            flag = "  ← REGRESSION" if worse > threshold else ""
+            regressions += bool(flag)
+            print(f"{server:9} {name:24} {then:10.2f} → {now:10.2f} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="票速通 webhook load test")
+    ap.add_argument("--servers", default="flask,gunicorn",
+                    help="comma list of flask, gunicorn, aiohttp")
+    ap.add_argument("--routes", default=",".join(SCENARIOS))
+    ap.add_argument("--requests", type=int, default=200, help="requests per route")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="stub reply latency")
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-status", type=int, default=500)
+    ap.add_argument("--event-workers", type=int, default=0)
+    ap.add_argument("--gunicorn-workers", type=int, default=2)
+    ap.add_argument("--gunicorn-threads", type=int, default=8)
+    ap.add_argument("--out", default=os.path.join(REPO, "bench", "results",
+                                                  time.strftime("bench-%Y%m%d-%H%M%S.json")))
+    ap.add_argument("--baseline", help="previous result JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10)
+    args = ap.parse_args()
+    args.routes = [r for r in args.routes.split(",") if r]
+    unknown = set(args.routes) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    stub = StubState(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status)
+    stub_server, _ = start_stub(0, stub)
+    stub_url = f"http://127.0.0.1:{stub_server.server_port}"
+
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                             capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ""
+    report = {
+        "meta": {
+            "git_rev": rev,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        },
+        "results": {},
+    }
+    for server in [s for s in args.servers.split(",") if s]:
+        print(f"── {server} ...", flush=True)
+        res = report["results"][server] = run_server(server, args, stub, stub_url)
+        print(f"{server:9} {res['throughput_rps']:8.1f} req/s  "
+              f"p50 {res['overall']['p50_ms']:.1f}ms  p95 {res['overall']['p95_ms']:.1f}ms  "
+              f"p99 {res['overall']['p99_ms']:.1f}ms")
+        for route, r in res["routes"].items():
+            print(f"  {route:12} n={r['count']:<5} p50 {r['p50_ms']:8.1f}  "
+                  f"p95 {r['p95_ms']:8.1f}  p99 {r['p99_ms']:8.1f}  {r['statuses']}")
+    stub_server.shutdown()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if _compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# bench/webhook_gen.py — 產生帶 X-Line-Signature 的 webhook body
+
+import json
+import hmac
+import time
+import base64
+import hashlib
+import uuid
+
+TOS_VERSION = "v1"
+
+# route 名稱對應 app.py 的路由
+SCENARIOS = {
+    "carousel": "[!!!]演唱會代操",
+    "tutorial": "[!!!]票速通使用教學",
+    "booking": "我要預訂：TWICE",
+    "consent": f"我同意，並了解自我權益關於票速通條款{TOS_VERSION}",
+    "keyword": "[!!!]售票規則是甚麼？",
+    "fallthrough": "請問還有票嗎",
+}
+
+
+def sign(channel_secret: str, body: str) -> str:
+    digest = hmac.new(channel_secret.encode("utf-8"), body.encode("utf-8"),
+                      hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def user_id(n: int) -> str:
+    return "U" + uuid.UUID(int=n).hex
+
+
+def make_body(text: str, uid: str, event_id: str | None = None,
+              redelivery: bool = False) -> str:
+    event = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "webhookEventId": event_id or uuid.uuid4().hex.upper(),
+        "deliveryContext": {"isRedelivery": redelivery},
+        "replyToken": uuid.uuid4().hex,
+        "source": {"type": "user", "userId": uid},
+        "message": {"type": "text", "id": str(uuid.uuid4().int)[:18],
+                    "quoteToken": uuid.uuid4().hex, "text": text},
+    }
+    return json.dumps({"destination": "Ubench", "events": [event]}, ensure_ascii=False)
+
+
+def signed_request(channel_secret: str, route: str, uid: str, **kw) -> tuple[bytes, dict]:
+    body = make_body(SCENARIOS[route], uid, **kw)
+    headers = {
+        "Content-Type": "application/json; charset=utf-8",
+        "X-Line-Signature": sign(channel_secret, body),
+    }
+    return body.encode("utf-8"), headers
@@ -0,0 +1,114 @@
+# catalog.py — 票速通 演唱會目錄（concerts.json，可熱更新）
+#
+# 讀者只拿 catalog.snapshot 這個不可變物件，不需要鎖；
+# 檔案有變動時建好新的 snapshot 再整個換掉。
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+import unicodedata
+from typing import NamedTuple
+
+BOOKABLE_STATUSES = ("open", "soon")
+
+
+class Concert(NamedTuple):
+    keyword: str
+    title: str
+    summary: str
+    date: str
+    location: str
+    price: str
+    system: str
+    image_url: str
+    badge: str = "NEW"
+    status: str = "open"
+    aliases: tuple = ()
+
+    @property
+    def bookable(self) -> bool:
+        return self.status in BOOKABLE_STATUSES
+
+    @property
+    def prices(self) -> tuple[int, ...]:
+        """票價欄列出的金額（「NT$6,990 / $5600」→ (6990, 5600)）；還沒公布就是空的。"""
+        return tuple(int(p.replace(",", ""))
+                     for p in re.findall(r"\d[\d,]*", unicodedata.normalize("NFKC", self.price)))
+
+
+def normalize(text: str) -> str:
+    """全形→半形、忽略大小寫與空白，讓「ｔｗｉｃｅ」「Twice 」都對得到。"""
+    return "".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class CatalogSnapshot:
+    def __init__(self, concerts: tuple, intro: str, outro: str, bubble_builder,
+                 version=None):
+        self.concerts = concerts
+        self.version = version
+        # 已結束的場次不出現在輪播和文字清單
+        listed = [c for c in concerts if c.bookable]
+        self.bubbles = tuple(bubble_builder(c) for c in listed)
+        self.intro_text = intro + "\n" + "".join(f"➣ {c.summary}\n" for c in listed) + outro
+        index: dict[str, Concert] = {}
+        for c in concerts:
+            for key in (c.keyword, c.title, c.summary, *c.aliases):
+                index.setdefault(normalize(key), c)
+        self._index = index
+
+    def lookup(self, text: str) -> Concert | None:
+        return self._index.get(normalize(text))
+
+
+def load_snapshot(path: str, bubble_builder, version=None) -> CatalogSnapshot:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    concerts = tuple(
+        Concert(**{**c, "aliases": tuple(c.get("aliases", ()))})
+        for c in data["concerts"])
+    return CatalogSnapshot(concerts, data.get("intro", ""), data.get("outro", ""),
+                           bubble_builder, version)
+
+
+class CatalogWatcher:
+    """讀取時順便每 interval 秒 stat 一次檔案；不開 thread，fork 後也安全。"""
+
+    def __init__(self, path: str, bubble_builder, interval: float = 2.0):
+        self.path = path
+        self._builder = bubble_builder
+        self._interval = interval
+        self._reload_lock = threading.Lock()
+        self._next_check = 0.0
+        self._version = self._stat()
+        self.snapshot: CatalogSnapshot = load_snapshot(path, bubble_builder, self._version)
+
+    def _stat(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def current(self) -> CatalogSnapshot:
+        now = time.monotonic()
+        if now >= self._next_check and self._reload_lock.acquire(blocking=False):
+            try:
+                self._next_check = now + self._interval
+                self._maybe_reload()
+            finally:
+                self._reload_lock.release()
+        return self.snapshot
+
+    def _maybe_reload(self):
+        try:
+            version = self._stat()
+            if version == self._version:
+                return
+            snapshot = load_snapshot(self.path, self._builder, version)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            # 編輯到一半的檔案先略過，沿用舊的 snapshot
+            logging.warning(f"[Catalog 載入失敗] {e}")
+            return
+        self._version = version
+        self.snapshot = snapshot
+        logging.info(f"[Catalog] 已重新載入 {len(snapshot.concerts)} 場演唱會")
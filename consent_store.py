@@ -0,0 +1,245 @@
+# consent_store.py — 票速通 條款同意紀錄
+#
+# 取代整檔重寫的 accepted_users.json：
+#   log     — append-only JSON Lines（預設）
+#   sqlite  — SQLite WAL
+# 兩者都把同時間的同意合併成一次寫入 + fsync（group commit）。
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+
+from user_registry import UserIdMap
+from group_commit import GroupCommitter
+from sqlite_local import LocalConnection
+
+
+class ConsentStore:
+    """uid → 最後同意的條款版本。讀取全在記憶體，寫入交給 group commit。"""
+
+    def __init__(self):
+        # uid 存成 16 bytes、版本存成 1 byte 代碼，追蹤者多時比 dict[str, str] 省很多
+        self._versions = UserIdMap()
+        self._committer = GroupCommitter(self._commit_batch, name="consent-writer")
+
+    def has_accepted(self, uid: str, version: str) -> bool:
+        if self._versions.get(uid) == version:
+            return True
+        # 可能是別的 worker 剛寫入，補讀一次
+        self._refresh(uid)
+        return self._versions.get(uid) == version
+
+    def accept(self, uid: str, version: str, wait: bool = True) -> bool:
+        """回傳 False 代表沒寫進去（flush 失敗或逾時），呼叫端要請使用者重送。"""
+        if self._versions.get(uid) == version:
+            return True
+        return self._committer.submit((uid, version, int(time.time())), wait=wait)
+
+    def _commit_batch(self, records: list[tuple]):
+        # 落盤成功後才更新記憶體，寫失敗就不會被當成已同意
+        self._write_batch(records)
+        self._versions.update((u, v) for u, v, _ in records)
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def users(self, version: str | None = None) -> list[str]:
+        return [u for u, v in self._versions.items() if version is None or v == version]
+
+    def close(self):
+        self._committer.stop()
+
+    # 子類實作
+    def _write_batch(self, records: list[tuple]):
+        raise NotImplementedError
+
+    def _refresh(self, uid: str):
+        pass
+
+    def compact(self):
+        pass
+
+
+class LogConsentStore(ConsentStore):
+    """每行一筆 {"u": uid, "v": version, "t": ts}；同一個 uid 以最後一行為準。"""
+
+    def __init__(self, path: str, compact_ratio: float = 2.0):
+        super().__init__()
+        self.path = path
+        self._compact_ratio = compact_ratio
+        self._read_lock = threading.Lock()
+        self._offset = 0
+        self._inode = None
+        self._lines = 0
+        self._load()
+
+    def _load(self):
+        with self._read_lock:
+            self._versions.clear()
+            self._offset = 0
+            self._lines = 0
+            self._inode = None
+            self._read_tail()
+
+    def _read_tail(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self._inode is not None and st.st_ino != self._inode:
+            # 被別的 process 壓縮過，從頭讀
+            self._versions.clear()
+            self._offset = 0
+            self._lines = 0
+        self._inode = st.st_ino
+        if st.st_size <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1          # 尾端沒寫完的半行先不讀
+        # 先收進一般 dict（同 uid 後蓋前），再一次交給 UserIdMap.update 走批次路徑
+        latest = {}
+        lines = data[:end].splitlines()
+        try:
+            # 整段當成一個 JSON array 一次解析；有損壞的行才退回逐行
+            records = json.loads(b"[" + b",".join(lines) + b"]")
+            latest = {rec["u"]: rec["v"] for rec in records}
+            self._lines += len(records)
+        except (ValueError, KeyError, TypeError):
+            for line in lines:
+                try:
+                    rec = json.loads(line)
+                    latest[rec["u"]] = rec["v"]
+                    self._lines += 1
+                except (ValueError, KeyError, TypeError):
+                    logging.warning("[Consent] 略過損壞的紀錄: %r", line[:80])
+        self._versions.update(latest.items())
+        self._offset += end
+
+    def _refresh(self, uid: str):
+        with self._read_lock:
+            self._read_tail()
+
+    def _write_batch(self, records):
+        payload = "".join(
+            json.dumps({"u": u, "v": v, "t": t}, ensure_ascii=False) + "\n"
+            for u, v, t in records).encode("utf-8")
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # 等鎖期間檔案若被壓縮替換，改寫新檔
+                if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                    continue
+                os.write(fd, payload)
+                os.fsync(fd)
+                break
+            finally:
+                os.close(fd)     # close 同時釋放 flock
+        with self._read_lock:
+            self._read_tail()
+        if self._lines > max(1024, len(self._versions) * self._compact_ratio):
+            self.compact()
+
+    def compact(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        lock_fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            # 從檔案重讀，每個 uid 保留最後一筆的版本與同意時間（t 是同意紀錄的一部分，不能改）
+            latest: dict[str, tuple] = {}
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        rec = json.loads(line)
+                        latest[rec["u"]] = (rec["v"], rec.get("t"))
+                    except (ValueError, KeyError):
+                        logging.warning("[Consent] 略過損壞的紀錄: %r", line[:80])
+            with open(tmp, "w", encoding="utf-8") as f:
+                for u, (v, t) in latest.items():
+                    f.write(json.dumps({"u": u, "v": v, "t": t}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        finally:
+            os.close(lock_fd)
+        self._load()
+
+    def import_legacy(self, legacy_path: str, version: str):
+        """舊版 accepted_users.json（uid 清單）只匯入一次。"""
+        if os.path.exists(self.path) or not os.path.exists(legacy_path):
+            return
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            uids = json.load(f)
+        now = int(time.time())
+        self._write_batch([(u, version, now) for u in uids])
+
+
+class SqliteConsentStore(ConsentStore):
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        # 每個 thread / process 各自一條連線；gunicorn --preload fork 之後不共用 parent 的
+        self._conn = LocalConnection(path)
+        db = self._conn()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS consent ("
+            " uid TEXT PRIMARY KEY, version TEXT NOT NULL, accepted_at INTEGER NOT NULL)")
+        self._versions.update(db.execute("SELECT uid, version FROM consent"))
+
+    def _refresh(self, uid: str):
+        row = self._conn().execute(
+            "SELECT version FROM consent WHERE uid = ?", (uid,)).fetchone()
+        if row is not None:
+            self._versions[uid] = row[0]
+
+    def _write_batch(self, records):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT INTO consent (uid, version, accepted_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(uid) DO UPDATE SET"
+                " version = excluded.version, accepted_at = excluded.accepted_at",
+                records)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def compact(self):
+        self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def import_legacy(self, legacy_path: str, version: str):
+        if not os.path.exists(legacy_path):
+            return
+        if self._conn().execute("SELECT 1 FROM consent LIMIT 1").fetchone():
+            return
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            uids = json.load(f)
+        now = int(time.time())
+        self._write_batch([(u, version, now) for u in uids])
+        self._versions.update((u, version) for u in uids)
+
+    def close(self):
+        super().close()
+        self._conn.close()
+
+
+def open_consent_store(backend: str, path: str, legacy_path: str | None = None,
+                       legacy_version: str = "v1") -> ConsentStore:
+    if backend == "sqlite":
+        store = SqliteConsentStore(path)
+    elif backend == "log":
+        store = LogConsentStore(path)
+    else:
+        raise ValueError(f"unknown consent backend: {backend}")
+    if legacy_path:
+        store.import_legacy(legacy_path, legacy_version)
+    return store
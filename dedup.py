@@ -0,0 +1,69 @@
+# dedup.py — 票速通 webhook 事件去重（LINE 重送時不重複處理）
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class EventDedup:
+    """webhookEventId 的 TTL + 容量上限集合；可選擇再問一次跨 worker 的共用狀態。"""
+
+    def __init__(self, max_size: int = 50000, ttl: float = 600.0, shared=None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.redeliveries = 0
+
+    @property
+    def shared(self) -> bool:
+        """有跨 worker 的共用狀態時，claim / release 會寫 SQLite（可能等鎖）。"""
+        return self._shared is not None
+
+    def claim(self, event_id: str | None, redelivery: bool = False) -> bool:
+        """第一次看到回傳 True；重複事件回傳 False。"""
+        if redelivery:
+            self.redeliveries += 1
+        if not event_id:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            expires = self._seen.get(event_id)
+            if expires is not None and expires > now:
+                self.hits += 1
+                return False
+            self._seen[event_id] = now + self._ttl
+            self._seen.move_to_end(event_id)
+            # TTL 固定，最舊的一定在最前面
+            while self._seen:
+                oldest, exp = next(iter(self._seen.items()))
+                if exp > now and len(self._seen) <= self._max_size:
+                    break
+                del self._seen[oldest]
+        if self._shared is not None and not self._shared.claim_once(f"evt:{event_id}", self._ttl):
+            self.shared_hits += 1
+            return False
+        self.misses += 1
+        return True
+
+    def release(self, event_id: str | None):
+        """處理失敗要讓 LINE 重送時，把 claim 還回去。"""
+        if not event_id:
+            return
+        with self._lock:
+            self._seen.pop(event_id, None)
+        if self._shared is not None:
+            self._shared.release_claim(f"evt:{event_id}")
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._seen),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "redeliveries": self.redeliveries,
+        }
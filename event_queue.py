@@ -0,0 +1,81 @@
+# event_queue.py — 票速通 背景事件處理池
+
+import os
+import queue
+import logging
+import threading
+import zlib
+
+_STOP = object()
+
+
+class EventWorkerPool:
+    """固定數量的 worker，同一個 key（user_id）永遠落在同一條佇列，保證順序。"""
+
+    def __init__(self, handle, workers: int = 4, maxsize: int = 1000,
+                 put_timeout: float = 1.0):
+        self._handle = handle
+        self._workers = max(1, workers)
+        # 每條佇列分到的容量，總量約等於 maxsize
+        self._shard_size = max(1, maxsize // self._workers)
+        self._put_timeout = put_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queues: list[queue.Queue] = []
+        self._threads: list[threading.Thread] = []
+
+    # gunicorn --preload 時 fork 之後執行緒不會跟過來，第一次使用才啟動
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queues = [queue.Queue(self._shard_size)
+                            for _ in range(self._workers)]
+            self._threads = []
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(q,),
+                                     name=f"event-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+
+    def _run(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                self._handle(item)
+            except Exception:
+                logging.exception("[Event 處理失敗]")
+            finally:
+                q.task_done()
+
+    def _shard(self, key: str) -> queue.Queue:
+        return self._queues[zlib.crc32(key.encode("utf-8")) % self._workers]
+
+    def submit(self, key: str, item) -> bool:
+        """放進對應佇列；佇列滿且等候逾時就回傳 False（由呼叫端回 503）。"""
+        self._ensure_started()
+        try:
+            self._shard(key or "").put(item, timeout=self._put_timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stop(self, timeout: float = 5.0):
+        if self._pid != os.getpid():
+            return
+        for q in self._queues:
+            try:
+                q.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+        for t in self._threads:
+            t.join(timeout)
+        self._pid = None
@@ -0,0 +1,87 @@
+# fanout.py — 票速通 開賣通知群發（multicast 分批、限併發、可續傳）
+
+import uuid
+import hashlib
+import logging
+import threading
+from collections import deque
+
+MULTICAST_MAX_RECIPIENTS = 500     # LINE multicast 單次上限
+
+_RETRY_NS = uuid.UUID("5b0c6f1e-8f0e-4d61-9a55-3f1f3c7f2a10")
+
+
+def fanout_job_id(concert_key: str, text: str) -> str:
+    """同一場演唱會、同一段通知文字 → 同一個 job，重下指令就是續傳。"""
+    return f"{concert_key}:{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]}"
+
+
+class MulticastFanout:
+    def __init__(self, scheduler, state, batch_size: int = MULTICAST_MAX_RECIPIENTS,
+                 max_in_flight: int = 4):
+        self._scheduler = scheduler
+        self._state = state
+        self._batch_size = min(batch_size, MULTICAST_MAX_RECIPIENTS)
+        self._max_in_flight = max(1, max_in_flight)
+        self._running: set[str] = set()
+        self._lock = threading.Lock()
+
+    def pending(self, job_id: str, recipients: list[str]) -> list[str]:
+        sent = self._state.fanout_sent(job_id)
+        # 去重並保持順序
+        return [u for u in dict.fromkeys(recipients) if u not in sent]
+
+    def run(self, job_id: str, recipients: list[str], messages: list) -> dict:
+        """阻塞直到全部批次送完；已送達的批次會記錄，中斷後再跑只送剩下的。"""
+        with self._lock:
+            if job_id in self._running:
+                return {"job_id": job_id, "status": "running"}
+            self._running.add(job_id)
+        try:
+            return self._run(job_id, recipients, messages)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+
+    def _run(self, job_id, recipients, messages) -> dict:
+        todo = self.pending(job_id, recipients)
+        batches = [todo[i:i + self._batch_size]
+                   for i in range(0, len(todo), self._batch_size)]
+        in_flight: deque = deque()
+        sent = failed = 0
+
+        def settle(batch, job):
+            nonlocal sent, failed
+            if job.wait():
+                self._state.mark_fanout_sent(job_id, batch)
+                sent += len(batch)
+            else:
+                failed += len(batch)
+                logging.error(f"[Fanout {job_id}] {len(batch)} 人送出失敗 (HTTP {job.status})")
+
+        for batch in batches:
+            if len(in_flight) >= self._max_in_flight:
+                settle(*in_flight.popleft())
+            # 同一批收件人 → 同一個 retry key，LINE 端也不會重複送
+            key = str(uuid.uuid5(_RETRY_NS, job_id + "\n" + "\n".join(batch)))
+            in_flight.append((batch, self._scheduler.multicast(batch, messages, retry_key=key)))
+        while in_flight:
+            settle(*in_flight.popleft())
+
+        return {
+            "job_id": job_id,
+            "status": "done" if not failed else "partial",
+            "total": len(dict.fromkeys(recipients)),
+            "skipped": len(dict.fromkeys(recipients)) - len(todo),
+            "sent": sent,
+            "failed": failed,
+            "batches": len(batches),
+        }
+
+    def start(self, job_id: str, recipients: list[str], messages: list, on_done=None):
+        """背景執行，完成後呼叫 on_done(result)。"""
+        def target():
+            result = self.run(job_id, recipients, messages)
+            if on_done is not None:
+                on_done(result)
+        threading.Thread(target=target, name=f"fanout-{job_id}", daemon=True).start()
@@ -0,0 +1,44 @@
+# flex_cache.py — 票速通 靜態 Flex 訊息快取
+
+import threading
+
+
+class Prebuilt:
+    """已經轉好的 JSON dict。Request 用 construct() 組起來時 to_dict() 直接沿用，
+    不必每次 reply 都把整個 carousel 用 pydantic 再轉一遍。"""
+    __slots__ = ("message", "payload")
+
+    def __init__(self, message):
+        self.message = message
+        self.payload = message.to_dict()
+
+    def to_dict(self) -> dict:
+        return self.payload
+
+
+class FlexCache:
+    """name → (來源 key, 已驗證並序列化的訊息)。來源資料換掉（key 不同）才重建。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, key, build):
+        entry = self._entries.get(name)
+        if entry is not None and (entry[0] is key or entry[0] == key):
+            self.hits += 1
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and (entry[0] is key or entry[0] == key):
+                return entry[1]
+            value = [Prebuilt(m) for m in build()]
+            self._entries[name] = (key, value)
+            self.misses += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,75 @@
+# group_commit.py — 票速通 group commit（條款同意、預訂單共用）
+#
+# 同一瞬間的多筆寫入合併成一次 transaction / fsync。
+
+import os
+import time
+import queue
+import logging
+import threading
+
+_STOP = object()
+
+
+class GroupCommitter:
+    """單一寫入 thread；把排隊中的紀錄一次 flush，呼叫端等到落盤才返回。"""
+
+    def __init__(self, flush, max_batch: int = 512, linger: float = 0.002,
+                 name: str = "group-commit"):
+        self._flush = flush
+        self._name = name
+        self._max_batch = max_batch
+        self._linger = linger
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            threading.Thread(target=self._run, name=self._name, daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, record, wait: bool = True, timeout: float = 5.0) -> bool:
+        """wait 時回傳是否已寫入成功（逾時或 flush 失敗都是 False）。"""
+        self._ensure_started()
+        done = threading.Event()
+        status = [True]
+        self._queue.put((record, done, status))
+        return done.wait(timeout) and status[0] if wait else True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is _STOP:
+                return
+            # 稍等一下讓同一波的寫入一起 flush
+            deadline = time.monotonic() + self._linger
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 \
+                        else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.put(_STOP)
+                    break
+                batch.append(item)
+            try:
+                self._flush([record for record, _, _ in batch])
+            except Exception:
+                logging.exception(f"[{self._name} 寫入失敗]")
+                for _, _, status in batch:
+                    status[0] = False
+            for _, done, _ in batch:
+                done.set()
+
+    def stop(self):
+        if self._pid == os.getpid():
+            self._queue.put(_STOP)
+            self._pid = None
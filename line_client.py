@@ -0,0 +1,105 @@
+# line_client.py — 票速通 共用 Messaging API 連線池
+
+import os
+import socket
+import threading
+import time
+
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from linebot.v3.messaging import ApiClient, MessagingApi
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.acquired += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+
+def _timed_pool(base, stats: PoolStats):
+    # 記錄等待可用連線的時間（block=True 時池滿會在這裡排隊）
+    class _Timed(base):
+        def _get_conn(self, timeout=None):
+            t0 = time.perf_counter()
+            try:
+                return super()._get_conn(timeout)
+            finally:
+                stats.record_wait(time.perf_counter() - t0)
+    return _Timed
+
+
+class LineClient:
+    """每個 process 一個 ApiClient，所有 thread 共用同一個 urllib3 連線池。"""
+
+    def __init__(self, configuration, pool_size: int = 10, block: bool = True):
+        self._configuration = configuration
+        self._pool_size = pool_size
+        self._block = block
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._api = None
+        self.pool_stats = PoolStats()
+
+    @property
+    def api(self) -> MessagingApi:
+        # fork 後要重建，不能沿用父 process 的 socket
+        if self._pid != os.getpid():
+            self._build()
+        return self._api
+
+    def _build(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            cfg = self._configuration
+            cfg.connection_pool_maxsize = self._pool_size
+            cfg.socket_options = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            ]
+            client = ApiClient(cfg)
+            pm = client.rest_client.pool_manager
+            pm.connection_pool_kw["block"] = self._block
+            self.pool_stats = PoolStats()
+            pm.pool_classes_by_scheme = {
+                "http": _timed_pool(HTTPConnectionPool, self.pool_stats),
+                "https": _timed_pool(HTTPSConnectionPool, self.pool_stats),
+            }
+            self._client = client
+            self._api = MessagingApi(client)
+            self._pid = os.getpid()
+
+    def stats(self) -> dict:
+        requests = connections = 0
+        if self._client is not None and self._pid == os.getpid():
+            pools = self._client.rest_client.pool_manager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    requests += pool.num_requests
+                    connections += pool.num_connections
+        s = self.pool_stats
+        return {
+            "pool_size": self._pool_size,
+            "requests": requests,
+            "connections": connections,
+            "reuse_rate": round(1 - connections / requests, 4) if requests else 0.0,
+            "wait_avg_ms": round(s.wait_total / s.acquired * 1000, 3) if s.acquired else 0.0,
+            "wait_max_ms": round(s.wait_max * 1000, 3),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = self._api = None
+            self._pid = None
@@ -0,0 +1,261 @@
+# metrics.py — 票速通 Prometheus 指標
+#
+# 記錄時只寫自己 thread 的 dict，不拿鎖；/metrics 抓取時才合併。
+# 設定 METRICS_DIR 時每個 gunicorn worker 會把快照寫成 metrics-<pid>.json，
+# 任一 worker 被抓取時合併全部檔案，數字才不會只代表單一 worker。
+# 部署 / 重啟前請清空 METRICS_DIR，否則舊 process 的 counter 會一直被加進來。
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        self._shards_lock = threading.Lock()
+        registry.register(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.d
+        except AttributeError:
+            d = self._local.d = {}
+            with self._shards_lock:
+                self._shards.append(d)
+            return d
+
+    def _reset_after_fork(self):
+        self._local = threading.local()
+        self._shards = []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        d = self._shard()
+        d[labels] = d.get(labels, 0) + amount
+
+    def collect(self) -> dict:
+        out: dict = {}
+        for d in list(self._shards):
+            for k, v in d.copy().items():
+                out[k] = out.get(k, 0) + v
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, help, labelnames)
+
+    def observe(self, value: float, *labels):
+        d = self._shard()
+        row = d.get(labels)
+        if row is None:
+            # [各 bucket（非累計）..., +Inf, sum, count]
+            row = d[labels] = [0] * (len(self.buckets) + 3)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def collect(self) -> dict:
+        out: dict = {}
+        for d in list(self._shards):
+            for k, row in d.copy().items():
+                acc = out.get(k)
+                if acc is None:
+                    out[k] = list(row)
+                else:
+                    for i, v in enumerate(row):
+                        acc[i] += v
+        return out
+
+
+class _Timer:
+    __slots__ = ("_h", "_labels", "_t0")
+
+    def __init__(self, h, labels):
+        self._h = h
+        self._labels = labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._h.observe(time.perf_counter() - self._t0, *self._labels)
+
+
+class Gauge(_Metric):
+    """抓取時呼叫 fn() 取值；merge 決定多個 worker 的值怎麼合併（sum / max）。"""
+    kind = "gauge"
+
+    def __init__(self, registry, name, help, fn, merge: str = "sum"):
+        self._fn = fn
+        self.merge = merge
+        super().__init__(registry, name, help)
+
+    def collect(self) -> dict:
+        try:
+            value = self._fn()
+        except Exception:
+            return {}
+        return {} if value is None else {(): value}
+
+
+class Registry:
+    def __init__(self, multiprocess_dir: str | None = None, flush_interval: float = 1.0):
+        self._metrics: list[_Metric] = []
+        self._dir = multiprocess_dir
+        self._interval = flush_interval
+        self._pid = None
+        self._origin_pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return Counter(self, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return Histogram(self, name, help, labelnames, buckets)
+
+    def gauge(self, name, help, fn, merge="sum") -> Gauge:
+        return Gauge(self, name, help, fn, merge)
+
+    # ── 多 process ──────────────────────────
+    def start(self):
+        """每個 process 第一次處理請求時呼叫；fork 後重新開始計數並啟動寫檔 thread。"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if os.getpid() != self._origin_pid:
+                for m in self._metrics:
+                    m._reset_after_fork()
+            self._pid = os.getpid()
+            if self._dir:
+                os.makedirs(self._dir, exist_ok=True)
+                threading.Thread(target=self._flush_loop, name="metrics-flush",
+                                 daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self._write_snapshot()
+            except Exception:
+                logging.exception("[Metrics 寫檔失敗]")
+
+    def _snapshot(self) -> dict:
+        snap = {}
+        for m in self._metrics:
+            snap[m.name] = [[list(k), v] for k, v in m.collect().items()]
+        return snap
+
+    def _write_snapshot(self):
+        path = os.path.join(self._dir, f"metrics-{os.getpid()}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._snapshot(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _merged(self) -> dict:
+        if not self._dir:
+            return {name: {tuple(k): v for k, v in rows}
+                    for name, rows in self._snapshot().items()}
+        self._write_snapshot()
+        kinds = {m.name: m for m in self._metrics}
+        merged: dict = {name: {} for name in kinds}
+        for fname in os.listdir(self._dir):
+            if not (fname.startswith("metrics-") and fname.endswith(".json")):
+                continue
+            pid = int(fname[8:-5])
+            alive = _pid_alive(pid)
+            try:
+                with open(os.path.join(self._dir, fname), "r", encoding="utf-8") as f:
+                    snap = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, rows in snap.items():
+                metric = kinds.get(name)
+                if metric is None:
+                    continue
+                if metric.kind == "gauge" and not alive:
+                    continue        # 已結束 worker 的 gauge 不算；counter 要保留
+                acc = merged[name]
+                for k, v in rows:
+                    k = tuple(k)
+                    if k not in acc:
+                        acc[k] = list(v) if isinstance(v, list) else v
+                    elif metric.kind == "histogram":
+                        acc[k] = [a + b for a, b in zip(acc[k], v)]
+                    elif metric.kind == "gauge" and metric.merge == "max":
+                        acc[k] = max(acc[k], v)
+                    else:
+                        acc[k] += v
+        return merged
+
+    # ── 輸出 ────────────────────────────────
+    def render(self) -> str:
+        data = self._merged()
+        lines = []
+        for m in self._metrics:
+            values = data.get(m.name, {})
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for labels, v in sorted(values.items()):
+                base = list(zip(m.labelnames, labels))
+                if m.kind == "histogram":
+                    cumulative = 0
+                    for bound, n in zip(m.buckets + (float("inf"),), v[:-2]):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{m.name}_bucket{_fmt(base + [('le', le)])} {cumulative}")
+                    lines.append(f"{m.name}_sum{_fmt(base)} {v[-2]}")
+                    lines.append(f"{m.name}_count{_fmt(base)} {v[-1]}")
+                else:
+                    lines.append(f"{m.name}{_fmt(base)} {v}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,189 @@
+# orders.py — 票速通 預訂單（填單解析、驗證、批次寫入、匯出）
+#
+# 使用者回傳的預訂單長這樣（一行一欄，也接受全部擠在同一行）：
+#   演唱會：TWICE
+#   日期：2026/03/21
+#   票價：4800
+#   張數（上限4張）：2
+# 寫入交給 group commit：開賣時同一瞬間上千張單，合併成少數幾次 transaction + fsync。
+
+import io
+import re
+import csv
+import time
+import unicodedata
+from typing import NamedTuple
+
+from catalog import Concert, CatalogSnapshot
+from group_commit import GroupCommitter
+from sqlite_local import LocalConnection, connect
+
+MAX_TICKETS = 4
+ORDER_FORM_TEMPLATE = "請填寫：\n演唱會：\n日期：\n票價：\n張數（上限4張）："
+CSV_COLUMNS = ("id", "created_at", "uid", "concert", "date", "price", "quantity", "raw")
+
+# NFKC 之後全形冒號、括號都變半形；「張數(上限4張):」的括號說明略過
+_FIELD_RE = re.compile(r"(演唱會|日期|票價|張數)\s*(?:\([^)]*\))?\s*:")
+# Excel 會把這些開頭的儲存格當公式；使用者打的字一律前面加 ' 當純文字
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+_CHINESE_NUMBERS = {"一": 1, "二": 2, "兩": 2, "三": 3, "四": 4, "五": 5}
+
+
+class Order(NamedTuple):
+    concert: str          # catalog keyword
+    date: str
+    price: int
+    quantity: int
+
+
+class OrderError(ValueError):
+    """填單內容有誤；訊息直接回給使用者。"""
+
+
+def parse_fields(text: str) -> dict[str, str]:
+    text = unicodedata.normalize("NFKC", text)
+    matches = list(_FIELD_RE.finditer(text))
+    fields = {}
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        value = text[m.end():nxt.start() if nxt else len(text)]
+        fields[m.group(1)] = value.strip(" \t\r\n,，、/")
+    return fields
+
+
+def looks_like_order_form(text: str) -> bool:
+    """至少填了兩欄才當成預訂單，「謝謝」之類的聊天照常走自動回覆。"""
+    return len(parse_fields(text)) >= 2
+
+
+_QUANTITY_RE = re.compile(r"(\d+|[一二兩三四五])\s*張?")
+_PRICE_RE = re.compile(r"(?:NT)?\$?\s*(\d{1,3}(?:,\d{3})+|\d+)\s*元?", re.IGNORECASE)
+
+
+def _parse_quantity(value: str) -> int | None:
+    """只收正整數（「2」「2張」「兩張」）；「-1」「1.5」之類一律不算。"""
+    m = _QUANTITY_RE.fullmatch(value)
+    if m is None:
+        return None
+    n = m.group(1)
+    return _CHINESE_NUMBERS[n] if n in _CHINESE_NUMBERS else int(n)
+
+
+def _parse_price(value: str) -> int | None:
+    m = _PRICE_RE.fullmatch(value)
+    return int(m.group(1).replace(",", "")) if m else None
+
+
+def parse_order(text: str, concert: Concert, snapshot: CatalogSnapshot) -> Order:
+    """解析並驗證；有問題時丟 OrderError，一次列出所有欄位的錯誤。"""
+    fields = parse_fields(text)
+    problems = []
+
+    name = fields.get("演唱會")
+    if name:
+        found = snapshot.lookup(name)
+        if found is None:
+            problems.append(f"查無演唱會「{name}」")
+        elif found.keyword != concert.keyword:
+            problems.append(f"演唱會與預訂的「{concert.title}」不符")
+
+    date = fields.get("日期", "")
+    if not date:
+        problems.append("請填寫日期")
+
+    price = _parse_price(fields.get("票價", ""))
+    if price is None:
+        problems.append("請填寫票價（數字）")
+    elif concert.prices and price not in concert.prices:
+        listed = " / ".join(f"{p:,}" for p in concert.prices)
+        problems.append(f"票價 {price:,} 不在此場次的票價中（{listed}）")
+
+    quantity = _parse_quantity(fields.get("張數", ""))
+    if quantity is None:
+        problems.append(f"張數請填 1～{MAX_TICKETS} 的整數")
+    elif not 1 <= quantity <= MAX_TICKETS:
+        problems.append(f"張數需為 1～{MAX_TICKETS} 張")
+
+    if problems:
+        raise OrderError("\n".join(f"➣ {p}" for p in problems))
+    return Order(concert.keyword, date, price, quantity)
+
+
+def _csv_text(value):
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class OrderStore:
+    """SQLite WAL；寫入經 group commit，讀取（匯出、統計）各自開連線不擋寫入。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = LocalConnection(path)
+        self._committer = GroupCommitter(self._write_batch, max_batch=1024,
+                                         name="order-writer")
+        db = self._conn()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS orders ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT NOT NULL,"
+            " concert TEXT NOT NULL, date TEXT NOT NULL, price INTEGER NOT NULL,"
+            " quantity INTEGER NOT NULL, raw TEXT NOT NULL, created_at INTEGER NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS orders_concert ON orders (concert, id)")
+
+    def add(self, uid: str, order: Order, raw: str, wait: bool = True) -> bool:
+        """排進下一批寫入；wait 時等到 commit 完成，回傳是否成功。"""
+        return self._committer.submit(
+            (uid, order.concert, order.date, order.price, order.quantity, raw,
+             int(time.time())), wait=wait)
+
+    def _write_batch(self, records: list[tuple]):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT INTO orders (uid, concert, date, price, quantity, raw, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def summary(self) -> dict[str, dict]:
+        """每場演唱會的訂單數、總張數。"""
+        return {concert: {"orders": n, "tickets": tickets}
+                for concert, n, tickets in self._conn().execute(
+                    "SELECT concert, COUNT(*), SUM(quantity) FROM orders"
+                    " GROUP BY concert ORDER BY concert")}
+
+    def rows(self, concert: str | None = None, since_id: int = 0):
+        sql = ("SELECT id, created_at, uid, concert, date, price, quantity, raw"
+               " FROM orders WHERE id > ?")
+        args: list = [since_id]
+        if concert:
+            sql += " AND concert = ?"
+            args.append(concert)
+        # 用獨立連線邊讀邊吐，匯出上萬筆也不會整包載入記憶體
+        db = connect(self.path)
+        try:
+            yield from db.execute(sql + " ORDER BY id", args)
+        finally:
+            db.close()
+
+    def export_csv(self, concert: str | None = None, since_id: int = 0, chunk: int = 500):
+        """產生 CSV 文字片段（含 BOM，Excel 直接開不會亂碼），給 streaming response 用。"""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        buf.write("\ufeff")
+        writer.writerow(CSV_COLUMNS)
+        for i, (oid, ts, *rest) in enumerate(self.rows(concert, since_id), 1):
+            writer.writerow((oid, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)),
+                             *map(_csv_text, rest)))
+            if i % chunk == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def close(self):
+        self._committer.stop()
+        self._conn.close()
@@ -0,0 +1,327 @@
+# outbound.py — 票速通 對外發送排程（限流、重試、reply 逾時改 push）
+#
+# 所有 reply / push / multicast 都經過這裡：
+#   - 每種 endpoint 一個 token bucket，對齊 LINE 的每 channel 速率上限
+#   - reply 優先於 push，push 優先於群發
+#   - 429 / 5xx / 連線錯誤以 jitter backoff 重試（429 依 Retry-After）；reply 重試到 token 快過期為止，
+#     push / multicast 最多 max_attempts 次
+#   - reply token 過期或被判定無效時，改用 push 送給 user_id（帶 X-Line-Retry-Key，不會重複）；
+#     其他 4xx（訊息格式錯誤等）push 一樣會失敗，不浪費 push 額度
+
+import os
+import time
+import uuid
+import heapq
+import random
+import logging
+import threading
+
+from linebot.v3.messaging import (
+    ReplyMessageRequest, PushMessageRequest, MulticastRequest, ApiException
+)
+
+PRIORITY_REPLY = 0
+PRIORITY_FALLBACK = 1
+PRIORITY_PUSH = 5
+PRIORITY_BULK = 9
+
+RETRYABLE_STATUSES = {0, 429, 500, 502, 503, 504}
+
+_STOP = object()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """預約一個 token，回傳需要等待的秒數。"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+            self._ts = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class RetryPolicy:
+    """送出失敗後要重試、改 push 還是放棄；同步排程與 async_app 共用同一套規則。"""
+
+    def __init__(self, max_attempts: int = 5, backoff_base: float = 0.2, backoff_cap: float = 5.0):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def backoff(self, attempts: int, retry_after: float | None = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempts))
+
+    def decide(self, kind: str, status: int, attempts: int, *, retry_key=None,
+               retry_after: float | None = None, deadline: float | None = None,
+               invalid_token: bool = False, maybe_delivered: bool = False) -> tuple[str, float]:
+        """回傳 (action, delay)，action 為 sent / retry / expired / fallback / failed。"""
+        # 409：同一個 retry key 已經送過，視為成功
+        if status == 200 or (status == 409 and retry_key):
+            return "sent", 0.0
+        if status in RETRYABLE_STATUSES:
+            delay = self.backoff(attempts, retry_after)
+            if kind == "reply":
+                # reply 不看次數，一直重試到 token 快過期，之後改 push
+                if time.time() + delay < deadline:
+                    return "retry", delay
+                return "expired", 0.0
+            if attempts < self.max_attempts:
+                return "retry", delay
+        # token 無效才改 push；前一次逾時的話多半是那次其實送到了、token 已用掉，不再補送
+        if kind == "reply" and invalid_token and not maybe_delivered:
+            return "fallback", 0.0
+        return "failed", 0.0
+
+
+def describe_error(e: Exception, kind: str) -> tuple[int, float | None, bool]:
+    """例外 → (HTTP status，連線錯誤為 0；Retry-After 秒數；是否為無效的 reply token)。"""
+    if isinstance(e, ApiException):
+        return (e.status or 0, _retry_after(e),
+                kind == "reply" and is_invalid_reply_token(e))
+    return 0, None, False
+
+
+class OutboundJob:
+    __slots__ = ("kind", "messages", "priority", "reply_token", "to", "deadline",
+                 "retry_key", "attempts", "status", "maybe_delivered", "ok", "_done")
+
+    def __init__(self, kind: str, messages: list, priority: int, reply_token=None,
+                 to=None, deadline=None, retry_key=None):
+        self.kind = kind
+        self.messages = messages
+        self.priority = priority
+        self.reply_token = reply_token
+        self.to = to
+        self.deadline = deadline
+        self.retry_key = retry_key
+        self.attempts = 0
+        self.status = None
+        self.maybe_delivered = False       # 有一次逾時 / 連線中斷，可能其實已送達
+        self.ok = None
+        self._done = threading.Event()
+
+    def finish(self, ok: bool):
+        self.ok = ok
+        self._done.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """等到送出或放棄；回傳是否成功。"""
+        self._done.wait(timeout)
+        return bool(self.ok)
+
+
+class OutboundScheduler:
+    def __init__(self, api_provider, rates: dict[str, float], workers: int = 4,
+                 max_attempts: int = 5, backoff_base: float = 0.2, backoff_cap: float = 5.0,
+                 reply_ttl: float = 50.0, push_fallback: bool = True,
+                 observer=None, on_event=None):
+        self._api = api_provider
+        self._buckets = {kind: TokenBucket(rate) for kind, rate in rates.items()}
+        self._workers = max(1, workers)
+        self.policy = RetryPolicy(max_attempts, backoff_base, backoff_cap)
+        self._reply_ttl = reply_ttl
+        self._push_fallback = push_fallback
+        self._observer = observer          # observer(kind, status, seconds)
+        self._on_event = on_event          # on_event(name)
+        self._cond = threading.Condition()
+        self._ready: list = []
+        self._delayed: list = []
+        self._seq = 0
+        self._pid = None
+        self._counts = {"queued": 0, "sent": 0, "retried": 0, "fallback": 0,
+                        "expired": 0, "failed": 0, "throttled": 0}
+
+    # ── 對外介面 ─────────────────────────────
+    def reply(self, reply_token: str, messages: list, user_id: str | None = None,
+              issued_at: float | None = None) -> OutboundJob:
+        deadline = (issued_at or time.time()) + self._reply_ttl
+        return self.submit(OutboundJob("reply", messages, PRIORITY_REPLY,
+                                       reply_token=reply_token, to=user_id, deadline=deadline))
+
+    def push(self, to: str, messages: list, priority: int = PRIORITY_PUSH,
+             retry_key: str | None = None) -> OutboundJob:
+        return self.submit(OutboundJob("push", messages, priority, to=to,
+                                       retry_key=retry_key or str(uuid.uuid4())))
+
+    def multicast(self, to: list[str], messages: list, retry_key: str | None = None,
+                  priority: int = PRIORITY_BULK) -> OutboundJob:
+        return self.submit(OutboundJob("multicast", messages, priority, to=to,
+                                       retry_key=retry_key or str(uuid.uuid4())))
+
+    def submit(self, job: OutboundJob) -> OutboundJob:
+        self._ensure_started()
+        with self._cond:
+            self._push_ready(job)
+            self._counts["queued"] += 1
+            self._cond.notify()
+        return job
+
+    def depth(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._counts, "ready": len(self._ready), "delayed": len(self._delayed)}
+
+    def stop(self, timeout: float = 5.0):
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self.depth() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._cond:
+            for _ in range(self._workers):
+                heapq.heappush(self._ready, (float("inf"), self._next_seq(), _STOP))
+            self._cond.notify_all()
+        self._pid = None
+
+    # ── 內部 ─────────────────────────────────
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._ready, self._delayed = [], []
+            for i in range(self._workers):
+                threading.Thread(target=self._run, name=f"outbound-{i}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def _push_ready(self, job):
+        heapq.heappush(self._ready, (job.priority, self._next_seq(), job))
+
+    def _event(self, name: str):
+        with self._cond:
+            self._counts[name] += 1
+        if self._on_event is not None:
+            self._on_event(name)
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, job = heapq.heappop(self._delayed)
+                    self._push_ready(job)
+                if self._ready:
+                    return heapq.heappop(self._ready)[2]
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is _STOP:
+                return
+            try:
+                self._process(job)
+            except Exception:
+                logging.exception("[Outbound 失敗]")
+                job.finish(False)
+
+    def _call(self, job: OutboundJob):
+        # 訊息在建立時已驗證過（flex_cache 的還是預先序列化的 Prebuilt），這裡不再重驗
+        api = self._api()
+        if job.kind == "reply":
+            api.reply_message(ReplyMessageRequest.construct(
+                reply_token=job.reply_token, messages=job.messages))
+        elif job.kind == "push":
+            api.push_message(PushMessageRequest.construct(to=job.to, messages=job.messages),
+                             x_line_retry_key=job.retry_key)
+        elif job.kind == "multicast":
+            api.multicast(MulticastRequest.construct(to=job.to, messages=job.messages),
+                          x_line_retry_key=job.retry_key)
+        else:
+            raise ValueError(job.kind)
+
+    def _process(self, job: OutboundJob):
+        if job.kind == "reply" and time.time() >= job.deadline:
+            self._event("expired")
+            self._fallback(job)
+            return
+
+        wait = self._buckets[job.kind].reserve()
+        if wait > 0:
+            self._event("throttled")
+            time.sleep(wait)
+
+        t0 = time.perf_counter()
+        retry_after = None
+        invalid_token = False
+        try:
+            self._call(job)
+            status = 200
+        except Exception as e:
+            status, retry_after, invalid_token = describe_error(e, job.kind)
+            logging.warning(f"[{job.kind} 失敗] "
+                            + (f"HTTP {status} {e.reason}" if isinstance(e, ApiException) else str(e)))
+        job.status = status
+        job.attempts += 1
+        job.maybe_delivered |= status == 0
+        if self._observer is not None:
+            self._observer(job.kind, str(status) if status else "error",
+                           time.perf_counter() - t0)
+
+        action, delay = self.policy.decide(
+            job.kind, status, job.attempts, retry_key=job.retry_key, retry_after=retry_after,
+            deadline=job.deadline, invalid_token=invalid_token,
+            maybe_delivered=job.maybe_delivered)
+        if action == "sent":
+            self._event("sent")
+            job.finish(True)
+        elif action == "retry":
+            self._event("retried")
+            with self._cond:
+                heapq.heappush(self._delayed, (time.monotonic() + delay, self._next_seq(), job))
+                self._cond.notify()
+        elif action == "expired":
+            self._event("expired")
+            self._fallback(job)
+        elif action == "fallback":
+            self._fallback(job)
+        else:
+            self._event("failed")
+            job.finish(False)
+
+    def _fallback(self, job: OutboundJob):
+        # 之前有一次逾時的話可能其實已送達，不補 push，免得重複
+        if job.kind == "reply" and self._push_fallback and job.to and not job.maybe_delivered:
+            self._event("fallback")
+            self.submit(OutboundJob("push", job.messages, PRIORITY_FALLBACK, to=job.to,
+                                    retry_key=str(uuid.uuid4())))
+        else:
+            self._event("failed")
+        job.finish(False)
+
+
+def is_invalid_reply_token(e: ApiException) -> bool:
+    """400 {"message": "Invalid reply token"}：token 過期或已經用過。"""
+    body = getattr(e, "body", None) or b""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    return e.status == 400 and "invalid reply token" in body.lower()
+
+
+def _retry_after(e: ApiException) -> float | None:
+    headers = getattr(e, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
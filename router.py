@@ -0,0 +1,123 @@
+# router.py — 票速通 文字訊息路由表
+
+import threading
+import time
+
+
+class MessageContext:
+    __slots__ = ("event", "text", "uid", "_replier")
+
+    def __init__(self, event, text: str, uid: str, replier):
+        self.event = event
+        self.text = text
+        self.uid = uid
+        self._replier = replier
+
+    @property
+    def reply_token(self) -> str:
+        return self.event.reply_token
+
+    def reply(self, message):
+        """message 可以是字串、單一 Message 或 Message list。"""
+        self._replier(self, message)
+
+
+class Route:
+    __slots__ = ("name", "fn", "guard", "observer", "calls", "total_ns", "max_ns", "_lock")
+
+    def __init__(self, name: str, fn, guard=None, observer=None):
+        self.name = name
+        self.fn = fn
+        self.guard = guard
+        self.observer = observer
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self._lock = threading.Lock()
+
+    def allowed(self, ctx: MessageContext) -> bool:
+        return self.guard is None or self.guard(ctx)
+
+    def run(self, ctx: MessageContext):
+        t0 = time.perf_counter_ns()
+        try:
+            return self.fn(ctx)
+        finally:
+            dt = time.perf_counter_ns() - t0
+            with self._lock:
+                self.calls += 1
+                self.total_ns += dt
+                if dt > self.max_ns:
+                    self.max_ns = dt
+            if self.observer is not None:
+                self.observer(self.name, dt / 1e9)
+
+
+class Router:
+    """完全比對走 dict；指令家族（「我要預訂：」、「[系統]」）走前綴索引。"""
+
+    def __init__(self, observer=None):
+        """observer(route_name, seconds) 在每次處理完後呼叫（給 metrics 用）。"""
+        self._observer = observer
+        self._exact: dict[str, Route] = {}
+        self._prefix: dict[str, Route] = {}
+        self._prefix_lens: list[int] = []
+        self._fallbacks: list[Route] = []
+
+    def exact(self, *texts: str, name: str | None = None, guard=None):
+        def decorator(fn):
+            route = Route(name or fn.__name__, fn, guard, self._observer)
+            for t in texts:
+                self._exact[t] = route
+            return fn
+        return decorator
+
+    def prefix(self, prefix: str, name: str | None = None, guard=None):
+        def decorator(fn):
+            self._prefix[prefix] = Route(name or fn.__name__, fn, guard, self._observer)
+            # 長的前綴優先
+            self._prefix_lens = sorted({len(p) for p in self._prefix}, reverse=True)
+            return fn
+        return decorator
+
+    def fallback(self, name: str | None = None, guard=None):
+        """沒有指令對得上時，依註冊順序找第一個 guard 通過的（例如「正在填單」）。"""
+        def decorator(fn):
+            self._fallbacks.append(Route(name or fn.__name__, fn, guard, self._observer))
+            return fn
+        return decorator
+
+    def resolve(self, ctx: MessageContext) -> Route | None:
+        text = ctx.text
+        route = self._exact.get(text)
+        if route is not None and route.allowed(ctx):
+            return route
+        for n in self._prefix_lens:
+            route = self._prefix.get(text[:n])
+            if route is not None and route.allowed(ctx):
+                return route
+        for route in self._fallbacks:
+            if route.allowed(ctx):
+                return route
+        return None
+
+    def dispatch(self, ctx: MessageContext):
+        route = self.resolve(ctx)
+        if route is not None:
+            route.run(ctx)
+
+    def routes(self) -> list[Route]:
+        seen = {}
+        for route in [*self._exact.values(), *self._prefix.values(), *self._fallbacks]:
+            seen[id(route)] = route
+        return list(seen.values())
+
+    def stats(self) -> dict:
+        return {
+            r.name: {
+                "calls": r.calls,
+                "avg_ms": round(r.total_ns / r.calls / 1e6, 3) if r.calls else 0.0,
+                "max_ms": round(r.max_ns / 1e6, 3),
+            }
+            for r in self.routes()
+        }
@@ -0,0 +1,42 @@
+# sqlite_local.py — 票速通 SQLite 連線（狀態、條款同意、預訂單共用）
+#
+# sqlite3 連線不能跨 thread，也不能帶過 fork（gunicorn --preload）：
+# 每個 thread、每個 process 各自開一條，都是 WAL + synchronous=NORMAL。
+
+import os
+import sqlite3
+import threading
+
+
+def connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA busy_timeout=5000")
+    return db
+
+
+class LocalConnection:
+    """呼叫時回傳本 thread 的連線；fork 之後第一次呼叫會重開。
+    on_open(local) 讓呼叫端在新連線上重設自己放在 thread-local 的快取。"""
+
+    def __init__(self, path: str, on_open=None):
+        self.path = path
+        self.local = threading.local()
+        self._on_open = on_open
+
+    def __call__(self) -> sqlite3.Connection:
+        local = self.local
+        if getattr(local, "pid", None) != os.getpid():
+            local.db = connect(self.path)
+            local.pid = os.getpid()
+            if self._on_open is not None:
+                self._on_open(local)
+        return local.db
+
+    def close(self):
+        """只關本 thread 的連線（其他 thread 的隨 process 結束）。"""
+        db = getattr(self.local, "db", None)
+        if db is not None and getattr(self.local, "pid", None) == os.getpid():
+            db.close()
+            self.local.pid = None
@@ -0,0 +1,170 @@
+# startup.py — 票速通 冷啟動計時
+#
+# 免費方案閒置會休眠，醒來後第一則回覆要等多久最重要。
+# 這裡記錄 process 啟動 → 各初始化階段 → 第一則 reply 送出的時間。
+#
+#   python startup.py --profile-startup              # app.py（Flask）
+#   python startup.py --profile-startup --module async_app --top 30
+#
+# 報告：-X importtime 的每個套件 import 時間 + app 的初始化階段。
+
+import os
+import time
+import threading
+
+
+def _process_started_at() -> float:
+    """process 真正啟動的時間（含直譯器本身與 import），取不到就用現在。"""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            # comm 可能含空白，從最後一個 ')' 之後算欄位
+            fields = f.read().rsplit(b")", 1)[1].split()
+        start_ticks = int(fields[19])
+        # starttime 是開機後的 tick 數；/proc/stat 的 btime 只到整秒，改用 CLOCK_BOOTTIME 算已經過多久
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.time() - max(age, 0.0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+
+BOOT = _process_started_at()
+_lock = threading.Lock()
+_phases: list[tuple[str, float]] = []
+_first_reply: float | None = None
+_pid = os.getpid()
+# 誰是進入點；async_app 在 import app 之前設成 "async"，app 就不暖同步的 Messaging API 連線
+server = "flask"
+
+
+def _reset_after_fork():
+    # gunicorn --preload：worker 的開機時間從 fork 算起
+    global BOOT, _first_reply, _pid
+    if _pid != os.getpid():
+        BOOT, _first_reply, _pid = _process_started_at(), None, os.getpid()
+
+
+def mark(phase: str):
+    """記錄某個初始化階段在開機後幾秒完成。"""
+    _reset_after_fork()
+    with _lock:
+        _phases.append((phase, round(time.time() - BOOT, 4)))
+
+
+def phases() -> list[tuple[str, float]]:
+    with _lock:
+        return list(_phases)
+
+
+def first_reply():
+    global _first_reply
+    _reset_after_fork()
+    if _first_reply is None:
+        with _lock:
+            if _first_reply is None:
+                _first_reply = time.time() - BOOT
+                _phases.append(("first_reply", round(_first_reply, 4)))
+
+
+def boot_to_first_reply() -> float | None:
+    _reset_after_fork()
+    return _first_reply
+
+
+# ────────────────────────────
+# --profile-startup
+# ────────────────────────────
+
+def _parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative)))
+    return rows
+
+
+def _package(name: str) -> str:
+    # linebot 分到 linebot.v3.messaging.api / .models 這層，其餘用最上層套件
+    parts = name.split(".")
+    return ".".join(parts[:4]) if parts[0] == "linebot" else parts[0]
+
+
+def profile_startup(module: str = "app", env: dict | None = None) -> dict:
+    """另開一個乾淨的 python -X importtime 匯入 module，回傳 import 與初始化時間。"""
+    # 只有跑報告時才需要，不算進 bot 本身的開機時間
+    import sys
+    import json
+    import tempfile
+    import subprocess
+
+    code = (f"import time, json; t0 = time.perf_counter(); import {module}; "
+            "t1 = time.perf_counter(); import startup; "
+            "print(json.dumps({'import_s': t1 - t0, 'boot_s': time.time() - startup.BOOT, "
+            "'phases': startup.phases()}))")
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, **(env or {})}
+    env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "profile-token")
+    env.setdefault("LINE_CHANNEL_SECRET", "profile-secret")
+    env["WARM_UP_CONNECT"] = "0"          # 只量本機的部分，不連 LINE
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [repo, env.get("PYTHONPATH")]))
+    # 在暫存目錄跑，consent / state 檔案不會寫進 repo
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                              cwd=workdir, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    summary = json.loads(proc.stdout.strip().splitlines()[-1])
+    rows = _parse_importtime(proc.stderr)
+    packages: dict[str, int] = {}
+    modules: dict[str, int] = {}
+    for name, self_us, _ in rows:
+        key = _package(name)
+        packages[key] = packages.get(key, 0) + self_us
+        # 同一個模組可能出現兩次（package __init__ 之後再被 import 一次）
+        modules[name] = modules.get(name, 0) + self_us
+    return {
+        "module": module,
+        "import_s": round(summary["import_s"], 4),
+        "boot_s": round(summary["boot_s"], 4),
+        "phases": summary["phases"],
+        "packages_ms": {k: round(v / 1000, 1) for k, v in
+                        sorted(packages.items(), key=lambda kv: -kv[1])},
+        "modules_ms": {k: round(v / 1000, 1) for k, v in
+                       sorted(modules.items(), key=lambda kv: -kv[1])},
+    }
+
+
+def _print_report(report: dict, top: int):
+    print(f"── {report['module']}：import {report['import_s'] * 1000:.0f} ms，"
+          f"開機到 import 完成 {report['boot_s'] * 1000:.0f} ms")
+    print("\n初始化階段（開機後秒數）")
+    for phase, seconds in report["phases"]:
+        print(f"  {phase:<24} {seconds:8.3f}")
+    print(f"\n套件 import（self time，前 {top}）")
+    for name, ms in list(report["packages_ms"].items())[:top]:
+        print(f"  {name:<40} {ms:8.1f} ms")
+    print(f"\n單一模組 import（self time，前 {top}）")
+    for name, ms in list(report["modules_ms"].items())[:top]:
+        print(f"  {name:<56} {ms:8.1f} ms")
+
+
+def main():
+    import json
+    import argparse
+
+    ap = argparse.ArgumentParser(description="票速通 cold start report")
+    ap.add_argument("--profile-startup", action="store_true", required=True)
+    ap.add_argument("--module", default="app", help="app or async_app")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = ap.parse_args()
+    report = profile_startup(args.module)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# state_backend.py — 票速通 跨 worker 共用狀態（已填單名單、系統開關）
+#
+#   memory  — 只在本 process（單 worker / 開發用）
+#   sqlite  — 所有 gunicorn worker 共用同一個 WAL 檔，重啟後保留
+
+import json
+import time
+import threading
+
+from user_registry import UserIdSet
+from sqlite_local import LocalConnection
+
+
+class StateBackend:
+    def mark_submitted(self, uid: str) -> bool:
+        """標記已填單；回傳 True 代表這次才標記（原本沒填過）。"""
+        raise NotImplementedError
+
+    def is_submitted(self, uid: str) -> bool:
+        raise NotImplementedError
+
+    def get_flag(self, name: str, default=None):
+        raise NotImplementedError
+
+    def set_flag(self, name: str, value):
+        raise NotImplementedError
+
+    def add_booking(self, uid: str, concert: str):
+        raise NotImplementedError
+
+    def booked_users(self, concert: str) -> list[str]:
+        raise NotImplementedError
+
+    def set_pending_order(self, uid: str, concert: str, ttl: float):
+        """送出預訂單範本後，ttl 秒內這位使用者的下一張單算在 concert 上。"""
+        raise NotImplementedError
+
+    def pending_order(self, uid: str) -> str | None:
+        raise NotImplementedError
+
+    def clear_pending_order(self, uid: str):
+        raise NotImplementedError
+
+    def fanout_sent(self, job_id: str) -> set[str]:
+        """群發工作已送達的 uid（中斷後續傳用）。"""
+        raise NotImplementedError
+
+    def mark_fanout_sent(self, job_id: str, uids: list[str]):
+        raise NotImplementedError
+
+    def claim_once(self, key: str, ttl: float) -> bool:
+        """key 在 ttl 秒內第一次出現才回傳 True。"""
+        raise NotImplementedError
+
+    def release_claim(self, key: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._submitted = UserIdSet()
+        self._flags: dict = {}
+        self._claims: dict[str, float] = {}
+        self._bookings: dict[str, dict[str, None]] = {}
+        self._pending: dict[str, tuple[str, float]] = {}
+        self._fanout: dict[str, set[str]] = {}
+
+    def mark_submitted(self, uid):
+        with self._lock:
+            if uid in self._submitted:
+                return False
+            self._submitted.add(uid)
+            return True
+
+    def is_submitted(self, uid):
+        return uid in self._submitted
+
+    def get_flag(self, name, default=None):
+        return self._flags.get(name, default)
+
+    def set_flag(self, name, value):
+        self._flags[name] = value
+
+    def add_booking(self, uid, concert):
+        with self._lock:
+            self._bookings.setdefault(concert, {})[uid] = None
+
+    def booked_users(self, concert):
+        return list(self._bookings.get(concert, ()))
+
+    def set_pending_order(self, uid, concert, ttl):
+        self._pending[uid] = (concert, time.time() + ttl)
+
+    def pending_order(self, uid):
+        entry = self._pending.get(uid)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            self._pending.pop(uid, None)
+            return None
+        return entry[0]
+
+    def clear_pending_order(self, uid):
+        self._pending.pop(uid, None)
+
+    def fanout_sent(self, job_id):
+        return set(self._fanout.get(job_id, ()))
+
+    def mark_fanout_sent(self, job_id, uids):
+        with self._lock:
+            self._fanout.setdefault(job_id, set()).update(uids)
+
+    def claim_once(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            expires = self._claims.get(key)
+            if expires is not None and expires > now:
+                return False
+            self._claims[key] = now + ttl
+            if len(self._claims) > 100000:
+                self._claims = {k: e for k, e in self._claims.items() if e > now}
+            return True
+
+    def release_claim(self, key):
+        with self._lock:
+            self._claims.pop(key, None)
+
+
+class SqliteStateBackend(StateBackend):
+    """每個 thread 一條連線；讀取先看本地快取，用 PRAGMA data_version 判斷別人有沒有寫過。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = LocalConnection(path, on_open=self._reset_local)
+        self._local = self._conn.local
+        # 已填單只會增加不會減少，命中過的就留在本地
+        self._submitted = UserIdSet()
+        db = self._conn()
+        db.execute("CREATE TABLE IF NOT EXISTS submitted ("
+                   " uid TEXT PRIMARY KEY, submitted_at INTEGER NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS flags ("
+                   " name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS claims ("
+                   " key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS bookings ("
+                   " concert TEXT NOT NULL, uid TEXT NOT NULL, booked_at INTEGER NOT NULL,"
+                   " PRIMARY KEY (concert, uid))")
+        db.execute("CREATE TABLE IF NOT EXISTS pending_orders ("
+                   " uid TEXT PRIMARY KEY, concert TEXT NOT NULL, expires_at REAL NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS fanout_sent ("
+                   " job_id TEXT NOT NULL, uid TEXT NOT NULL, PRIMARY KEY (job_id, uid))")
+        self._claim_count = 0
+
+    @staticmethod
+    def _reset_local(local):
+        local.version = None
+        local.flags = {}
+
+    def _fresh_flags(self) -> dict:
+        db = self._conn()
+        local = self._local
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version != local.version:
+            local.flags = {name: json.loads(value)
+                           for name, value in db.execute("SELECT name, value FROM flags")}
+            local.version = version
+        return local.flags
+
+    def mark_submitted(self, uid):
+        if uid in self._submitted:
+            return False
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO submitted (uid, submitted_at) VALUES (?, ?)",
+            (uid, int(time.time())))
+        self._submitted.add(uid)
+        return cur.rowcount == 1
+
+    def is_submitted(self, uid):
+        if uid in self._submitted:
+            return True
+        row = self._conn().execute(
+            "SELECT 1 FROM submitted WHERE uid = ?", (uid,)).fetchone()
+        if row is not None:
+            self._submitted.add(uid)
+            return True
+        return False
+
+    def get_flag(self, name, default=None):
+        return self._fresh_flags().get(name, default)
+
+    def set_flag(self, name, value):
+        self._conn().execute(
+            "INSERT INTO flags (name, value) VALUES (?, ?)"
+            " ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, json.dumps(value, ensure_ascii=False)))
+        # 自己這條連線的寫入不會讓 data_version 變動，直接更新本地快取
+        self._fresh_flags()[name] = value
+
+    def add_booking(self, uid, concert):
+        self._conn().execute(
+            "INSERT OR IGNORE INTO bookings (concert, uid, booked_at) VALUES (?, ?, ?)",
+            (concert, uid, int(time.time())))
+
+    def booked_users(self, concert):
+        return [uid for (uid,) in self._conn().execute(
+            "SELECT uid FROM bookings WHERE concert = ? ORDER BY booked_at, uid", (concert,))]
+
+    def set_pending_order(self, uid, concert, ttl):
+        self._conn().execute(
+            "INSERT INTO pending_orders (uid, concert, expires_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(uid) DO UPDATE SET"
+            " concert = excluded.concert, expires_at = excluded.expires_at",
+            (uid, concert, time.time() + ttl))
+
+    def pending_order(self, uid):
+        row = self._conn().execute(
+            "SELECT concert FROM pending_orders WHERE uid = ? AND expires_at > ?",
+            (uid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def clear_pending_order(self, uid):
+        self._conn().execute("DELETE FROM pending_orders WHERE uid = ?", (uid,))
+
+    def fanout_sent(self, job_id):
+        return {uid for (uid,) in self._conn().execute(
+            "SELECT uid FROM fanout_sent WHERE job_id = ?", (job_id,))}
+
+    def mark_fanout_sent(self, job_id, uids):
+        db = self._conn()
+        db.execute("BEGIN")
+        try:
+            db.executemany("INSERT OR IGNORE INTO fanout_sent (job_id, uid) VALUES (?, ?)",
+                           [(job_id, uid) for uid in uids])
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def claim_once(self, key, ttl):
+        now = time.time()
+        db = self._conn()
+        cur = db.execute(
+            "INSERT INTO claims (key, expires_at) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at"
+            " WHERE claims.expires_at <= ?",
+            (key, now + ttl, now))
+        self._claim_count += 1
+        if self._claim_count % 1000 == 0:
+            db.execute("DELETE FROM claims WHERE expires_at <= ?", (now,))
+        return cur.rowcount == 1
+
+    def release_claim(self, key):
+        self._conn().execute("DELETE FROM claims WHERE key = ?", (key,))
+
+    def close(self):
+        self._conn.close()
+
+
+def open_state_backend(backend: str, path: str | None = None) -> StateBackend:
+    if backend == "memory":
+        return MemoryStateBackend()
+    if backend == "sqlite":
+        return SqliteStateBackend(path)
+    raise ValueError(f"unknown state backend: {backend}")
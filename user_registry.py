@@ -0,0 +1,322 @@
+# user_registry.py — 票速通 精簡 user ID 名單
+#
+# LINE user ID 是 "U" + 32 個 hex。存成 str 每筆 80 幾 bytes，放進 set / dict 再加上雜湊表，
+# 追蹤者一多，每個 gunicorn worker 都要多吃一份。這裡把 ID 還原成 16 bytes：
+#   - 依（槽位, key）排好序接成一整塊 bytes（可以 mmap 同一個檔案，所有 worker 共用 page cache）
+#   - 查詢：槽位 = key 當整數 mod 65521，取高 4～16 bits 當桶子（平均每桶幾筆），
+#     桶內用 bytes.find 在 C 裡找，O(1)。不直接用 key 的前幾個 byte：
+#     前綴相同的 ID（測試、壓測用的流水號）會全擠進同一桶，變成線性掃描
+#   - 新加入的先放進小的 delta dict，累積到 base 的 1/8 再由背景 thread 合併；
+#     合併時新的寫入照樣進 delta，不會讓 request thread 等排序
+#   - 每筆可以帶一個小值（例如條款版本），以 1 byte 代碼存在旁邊
+# 不符合格式的 ID（測試用、未來格式）放在一般 dict，行為不變。
+
+import os
+import mmap
+import logging
+import threading
+from array import array
+from itertools import accumulate
+
+KEY_SIZE = 16
+MAX_VALUES = 256
+_SLOTS = 65521          # < 2**16 的最大質數；槽位固定不隨 process 變（不能用 hash()）
+
+
+def _slot(key: bytes) -> int:
+    return int.from_bytes(key, "big") % _SLOTS
+
+
+def _order(key: bytes) -> tuple[int, bytes]:
+    """base 裡的排列順序。"""
+    return _slot(key), key
+
+
+def encode_uid(uid: str) -> bytes | None:
+    """"U" + 32 個小寫 hex → 16 bytes；其他格式回傳 None。"""
+    if len(uid) != 33 or uid[0] != "U":
+        return None
+    hex_part = uid[1:]
+    try:
+        key = bytes.fromhex(hex_part)
+    except ValueError:
+        return None
+    # fromhex 也吃大寫；解回來不一樣的就當作其他格式，才不會把兩個 ID 併成一個
+    return key if len(key) == KEY_SIZE and key.hex() == hex_part else None
+
+
+def decode_uid(key: bytes) -> str:
+    return "U" + key.hex()
+
+
+class _Base:
+    """依 _order 排好的 key + 每筆的值代碼 + 桶子索引；整個物件一起換掉，讀的人不用鎖。"""
+    __slots__ = ("buf", "codes", "index", "shift")
+
+    def __init__(self, buf, codes: bytearray):
+        self.buf = buf
+        self.codes = codes
+        n = len(buf) // KEY_SIZE
+        # 平均每桶約 4 筆；索引每桶 4 bytes
+        bits = min(16, max(4, (n // 4).bit_length()))
+        self.shift = shift = 16 - bits
+        counts = array("I", bytes(4 * ((1 << bits) + 1)))
+        for offset in range(0, n * KEY_SIZE, KEY_SIZE):
+            counts[(_slot(buf[offset:offset + KEY_SIZE]) >> shift) + 1] += 1
+        self.index = array("I", accumulate(counts))
+
+    def __len__(self) -> int:
+        return len(self.buf) // KEY_SIZE
+
+    def key(self, i: int) -> bytes:
+        offset = i * KEY_SIZE
+        return self.buf[offset:offset + KEY_SIZE]
+
+    def find(self, key: bytes) -> int:
+        p = _slot(key) >> self.shift
+        end = self.index[p + 1] * KEY_SIZE
+        buf = self.buf
+        offset = buf.find(key, self.index[p] * KEY_SIZE, end)
+        # 跨兩筆湊出來的假命中（幾乎不會發生）跳過
+        while offset >= 0 and offset % KEY_SIZE:
+            offset = buf.find(key, offset + 1, end)
+        return offset // KEY_SIZE if offset >= 0 else -1
+
+
+class UserIdMap:
+    """uid → 小值（None 或最多 255 種不同的值）。支援 get / [uid] = v / in / len / items。
+    不支援刪除；要重來就 clear()。"""
+
+    def __init__(self, items=()):
+        self._lock = threading.RLock()
+        self._values: list = [None]          # 代碼 → 值；0 保留給 None
+        self._codes: dict = {None: 0}
+        self._base = _Base(b"", bytearray())
+        self._delta: dict[bytes, int] = {}
+        self._merging: dict[bytes, int] = {}  # 背景合併中的那批，合併完才清掉
+        self._merge_pid = None                # 背景合併進行中的 process
+        self._size = 0                        # base / merging / delta 裡不重複的 key 數
+        self._other: dict[str, int] = {}
+        self.update(items)
+
+    # ── 讀取 ─────────────────────────────────
+    def _lookup(self, uid: str) -> int | None:
+        key = encode_uid(uid)
+        if key is None:
+            return self._other.get(uid)
+        # 依 delta → merging → base 的順序讀：合併開始時先設 merging 再清 delta，
+        # 結束時先換 base 再清 merging，不加鎖也總有一邊看得到
+        code = self._delta.get(key)
+        if code is None:
+            code = self._merging.get(key)
+        if code is not None:
+            return code
+        base = self._base
+        i = base.find(key)
+        return base.codes[i] if i >= 0 else None
+
+    def get(self, uid: str, default=None):
+        code = self._lookup(uid)
+        return default if code is None else self._values[code]
+
+    def __contains__(self, uid: str) -> bool:
+        return self._lookup(uid) is not None
+
+    def __len__(self) -> int:
+        return self._size + len(self._other)
+
+    def items(self):
+        with self._lock:
+            base, values = self._base, self._values
+            delta = {**self._merging, **self._delta}
+            other = dict(self._other)
+        for i in range(len(base)):
+            key = base.key(i)
+            if key not in delta:
+                yield decode_uid(key), values[base.codes[i]]
+        for key, code in delta.items():
+            yield decode_uid(key), values[code]
+        for uid, code in other.items():
+            yield uid, values[code]
+
+    def __iter__(self):
+        return (uid for uid, _ in self.items())
+
+    def nbytes(self) -> int:
+        """約略的記憶體用量（mmap 的部分不算，那是共用的 page cache）。"""
+        base = self._base
+        shared = isinstance(base.buf, mmap.mmap)
+        return ((0 if shared else len(base.buf)) + len(base.codes)
+                + base.index.itemsize * len(base.index)
+                + (len(self._delta) + len(self._merging)) * 120 + len(self._other) * 150)
+
+    # ── 寫入 ─────────────────────────────────
+    def _code(self, value) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            if len(self._values) >= MAX_VALUES:
+                raise ValueError(f"UserIdMap holds at most {MAX_VALUES} distinct values")
+            code = self._codes[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def __setitem__(self, uid: str, value):
+        with self._lock:
+            self._set(uid, self._code(value))
+
+    def _set(self, uid: str, code: int, merge: bool = True) -> bool:
+        """回傳 True 代表這個 uid 原本不在名單裡。"""
+        key = encode_uid(uid)
+        if key is None:
+            new = uid not in self._other
+            self._other[uid] = code
+            return new
+        base = self._base
+        if key in self._delta or key in self._merging:
+            new = False
+        else:
+            i = base.find(key)
+            if i >= 0 and self._merge_pid is None and not self._merging:
+                base.codes[i] = code
+                return False
+            # 合併中 base 正在被讀來排序，改動先記在 delta（讀取時 delta 優先）
+            new = i < 0
+        self._delta[key] = code
+        self._size += new
+        if merge and len(self._delta) > max(1024, len(base) // 8):
+            self._start_merge()
+        return new
+
+    def update(self, items):
+        # 大量載入時全部先進 delta，最後一起排序；比現有名單還大（啟動載入）就直接合併
+        with self._lock:
+            for uid, value in items:
+                self._set(uid, self._code(value), merge=False)
+            if len(self._delta) > max(1024, len(self._base)):
+                self._merge()
+            elif len(self._delta) > max(1024, len(self._base) // 8):
+                self._start_merge()
+
+    def clear(self):
+        with self._lock:
+            self._base = _Base(b"", bytearray())
+            self._delta = {}
+            self._merging = {}
+            self._merge_pid = None
+            self._size = 0
+            self._other = {}
+
+    @staticmethod
+    def _build(base: _Base, delta: dict) -> _Base:
+        # base 已經排好序：只排 delta，再一筆筆插進 base 的位置，中間整段用 slice 複製。
+        # 不對整份名單做一次大 sort / 大迴圈，背景合併時不會長時間霸住 GIL
+        if not len(base):
+            keys = sorted(delta, key=_order)
+            return _Base(b"".join(keys), bytearray(delta[k] for k in keys))
+        buf, codes, index, shift = base.buf, bytearray(base.codes), base.index, base.shift
+        inserts = []
+        for key in sorted(delta, key=_order):
+            i = base.find(key)
+            if i >= 0:
+                codes[i] = delta[key]       # 已有的 key 只改值
+                continue
+            order = _order(key)
+            p = order[0] >> shift
+            pos, end = index[p], index[p + 1]
+            while pos < end and _order(base.key(pos)) < order:
+                pos += 1
+            inserts.append((pos, key))
+        if not inserts:
+            return _Base(buf, codes)
+        keys, new_codes, prev = [], bytearray(), 0
+        for pos, key in inserts:
+            keys.append(buf[prev * KEY_SIZE:pos * KEY_SIZE])
+            keys.append(key)
+            new_codes += codes[prev:pos]
+            new_codes.append(delta[key])
+            prev = pos
+        keys.append(buf[prev * KEY_SIZE:])
+        new_codes += codes[prev:]
+        return _Base(b"".join(keys), new_codes)
+
+    def _start_merge(self):
+        """在鎖內呼叫：把 delta 交給背景 thread 合併。"""
+        if self._merge_pid == os.getpid():
+            return                      # 已經在合併
+        # fork 前沒合併完的那批（child 裡沒有 thread 在做）一起帶上
+        self._merging = {**self._merging, **self._delta}
+        self._delta = {}
+        self._merge_pid = os.getpid()
+        threading.Thread(target=self._merge_in_background, args=(self._base, self._merging),
+                         name="uid-registry-merge", daemon=True).start()
+
+    def _merge_in_background(self, base: _Base, merging: dict):
+        try:
+            new_base = self._build(base, merging)
+        except Exception:
+            logging.exception("[UserIdMap 合併失敗]")
+            new_base = None
+        with self._lock:
+            if self._merging is not merging:
+                return                  # 期間被 clear() / compact() 換掉了
+            if new_base is not None:
+                self._base = new_base
+                self._merging = {}
+            self._merge_pid = None
+
+    def _merge(self):
+        """在鎖內同步合併（save / compact / 大量載入用）；進行中的背景合併結果作廢。"""
+        pending = {**self._merging, **self._delta}
+        if pending:
+            self._base = self._build(self._base, pending)
+        self._merging = {}
+        self._merge_pid = None
+        self._delta = {}
+
+    def compact(self):
+        with self._lock:
+            self._merge()
+
+    # ── 檔案 ─────────────────────────────────
+    def save(self, path: str):
+        """只存 key（依 _order 排好的 16 bytes 陣列）；值由各自的 store 保存。
+        格式外的 ID 不會寫進檔案。"""
+        with self._lock:
+            self._merge()
+            buf = self._base.buf
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, use_mmap: bool = True):
+        """讀 save() 寫的檔案。use_mmap 時 key 直接對應到檔案，多個 worker 共用同一份記憶體；
+        之後新增的先放 delta，合併時才複製成本 process 自己的 bytes。"""
+        registry = cls()
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size % KEY_SIZE:
+                raise ValueError(f"{path}: size {size} is not a multiple of {KEY_SIZE}")
+            if use_mmap and size:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+        registry._base = _Base(buf, bytearray(size // KEY_SIZE))
+        registry._size = size // KEY_SIZE
+        return registry
+
+
+class UserIdSet(UserIdMap):
+    """只要「在不在名單裡」的版本。"""
+
+    def __init__(self, uids=()):
+        super().__init__()
+        self.update((uid, None) for uid in uids)
+
+    def add(self, uid: str) -> bool:
+        """加入名單；回傳 True 代表原本不在。"""
+        with self._lock:
+            return self._set(uid, 0)